@@ -0,0 +1,102 @@
+# Сквозной бенчмарк без токена и сети: ws.main() против локального mock_webmaster.py,
+# затем kill_duplicates.main() на собранной таблице. Печатает URL/с, запросов/с и строк/с.
+# Каждый замер идет в новой временной папке, то есть с пустыми кэшами ответов и лемм.
+# Запуск: python benchmarks/bench_e2e.py --urls 100 --queries 200 --latency 50 --modes default parquet
+import argparse
+import contextlib
+import csv
+import os
+import shutil
+import sys
+import tempfile
+import time
+
+BENCHMARKS = os.path.dirname(os.path.abspath(__file__))
+ROOT = os.path.dirname(BENCHMARKS)
+sys.path.insert(0, ROOT)
+sys.path.insert(0, BENCHMARKS)
+from mock_webmaster import add_dataset_arguments, make_dataset, start_server
+
+MODES = {
+    'default': {},
+    'parquet': {'parquet': True},
+    'history': {'history': 'period'},
+}
+
+
+def count_rows(path):
+    with open(path, 'r', encoding='utf-8-sig') as file:
+        return sum(1 for _ in csv.reader(file, delimiter=';')) - 1
+
+
+def run_ws(ws, server, urls, mode, max_rate):
+    # Свежие ограничитель, клиентский кэш и кривые CTR - замер не зависит от предыдущего
+    ws.client.limiter = ws.RateLimiter(max_rate=max_rate)
+    ws.client.cache = ws.ResponseCache()
+    ws.ctr_cache = ws.CtrCurveCache()
+    with open(ws.URLS_FILE, 'w', encoding='utf-8') as file:
+        file.write('\n'.join(urls))
+
+    options = dict(MODES[mode])
+    if options.get('history'):
+        options['history'] = ws.default_period()
+    requests_before = server.requests
+    start = time.perf_counter()
+    ws.main(**options)
+    elapsed = time.perf_counter() - start
+    return elapsed, server.requests - requests_before, count_rows(ws.OUTPUT_CSV)
+
+
+def run_kill_duplicates(workers):
+    import kill_duplicates
+    rows = count_rows('query_analytics.csv')
+    start = time.perf_counter()
+    kill_duplicates.main(workers=workers)
+    elapsed = time.perf_counter() - start
+    return elapsed, rows, count_rows('query_analytics_lemmatization.csv')
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    add_dataset_arguments(parser)
+    parser.add_argument('--modes', nargs='+', choices=list(MODES), default=['default', 'parquet'])
+    parser.add_argument('--max-rate', type=float, default=50, help='потолок ограничителя скорости ws.py, запросов/с')
+    parser.add_argument('--workers', type=int, default=1, help='процессов лемматизации в kill_duplicates')
+    parser.add_argument('--skip-dedup', action='store_true', help='не замерять kill_duplicates.py')
+    parser.add_argument('--verbose', action='store_true', help='показывать вывод ws.py и kill_duplicates.py')
+    args = parser.parse_args()
+
+    dataset = make_dataset(args)
+    server = start_server(dataset, latency=args.latency / 1000, error_rate=args.error_rate, seed=args.seed)
+    os.environ['WEBMASTER_API_BASE'] = server.base_url
+    cwd = os.getcwd()
+    import ws  # Адрес API читается при импорте, поэтому импортируем после запуска сервера
+    urls = dataset.urls()
+    print(f"Хостов: {args.hosts}, URL: {len(urls)}, задержка: {args.latency:.0f} мс, ошибок: {args.error_rate:.0%}")
+
+    results = []
+    for mode in args.modes:
+        with tempfile.TemporaryDirectory() as folder:
+            os.chdir(folder)
+            shutil.copy(os.path.join(ROOT, 'stopwords.txt'), 'stopwords.txt')
+            open('brand.txt', 'w').close()
+            quiet = contextlib.nullcontext() if args.verbose else contextlib.redirect_stdout(open(os.devnull, 'w'))
+            try:
+                with quiet:
+                    elapsed, requests, rows = run_ws(ws, server, urls, mode, args.max_rate)
+                results.append(f"ws.py {mode}: {elapsed:.2f} с, {len(urls) / elapsed:.1f} URL/с, "
+                               f"{requests / elapsed:.1f} запросов/с ({requests}), {rows / elapsed:,.0f} строк/с ({rows})")
+                if not args.skip_dedup and mode == args.modes[0]:
+                    with quiet:
+                        elapsed, rows, merged = run_kill_duplicates(args.workers)
+                    results.append(f"kill_duplicates.py: {elapsed:.2f} с, {rows / elapsed:,.0f} строк/с ({rows} -> {merged})")
+            finally:
+                os.chdir(cwd)
+
+    print()
+    for line in results:
+        print(line)
+
+
+if __name__ == '__main__':
+    main()
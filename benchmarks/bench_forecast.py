@@ -0,0 +1,116 @@
+# Бенчмарк CTR по позициям и прогноза кликов в ws.py: прежние calculate_average_ctr_per_position
+# (два поиска next() по статистике на каждую позицию) и forecast_clicks по строке против
+# однопроходной свертки через np.bincount и forecast_clicks_batch для всех запросов сразу.
+# Данные - синтетическая аналитика из mock_webmaster.py. Заодно проверяет, что результаты совпадают.
+# Запуск: python benchmarks/bench_forecast.py --queries 20000 --days 30
+import argparse
+import os
+import random
+import sys
+import time
+from collections import defaultdict
+
+BENCHMARKS = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.dirname(BENCHMARKS))
+sys.path.insert(0, BENCHMARKS)
+cwd = os.getcwd()
+from ws import calculate_average_ctr_per_position, forecast_clicks_batch, format_query_analytics, summarize_query_analytics
+os.chdir(cwd)  # ws.py при импорте переходит в свою папку
+from mock_webmaster import Dataset
+
+
+def calculate_average_ctr_per_position_loop(items, position_data=None):
+    # Прежняя реализация из ws.py
+    if position_data is None:
+        position_data = defaultdict(lambda: {'clicks': 0, 'impressions': 0})
+    for item in items:
+        stats = item.get('statistics', [])
+        for stat in stats:
+            if stat.get('field') == 'POSITION' and stat.get('value') <= 15:
+                pos = int(stat.get('value'))
+                clicks = next((s['value'] for s in stats if s['field'] == 'CLICKS'), 0)
+                impressions = next((s['value'] for s in stats if s['field'] == 'IMPRESSIONS'), 0)
+                position_data[pos]['clicks'] += clicks
+                position_data[pos]['impressions'] += impressions
+    return position_data
+
+
+def forecast_clicks(average_position, average_ctr_per_position, total_demand, total_clicks, ctr_data):
+    # Прежняя реализация из ws.py, вызывалась для каждой строки
+    ctr_1_1 = [ctr_data.get(i, 0) for i in range(1, 2)]
+    ctr_1_3 = [ctr_data.get(i, 0) for i in range(1, 4)]
+    ctr_1_5 = [ctr_data.get(i, 0) for i in range(1, 6)]
+
+    ctr_1 = average_ctr_per_position.get(1, {'clicks': 0, 'impressions': 0})
+    ctr_3 = average_ctr_per_position.get(3, {'clicks': 0, 'impressions': 0})
+    ctr_5 = average_ctr_per_position.get(5, {'clicks': 0, 'impressions': 0})
+
+    ctr_1_av = sum(ctr_1_1) / len(ctr_1_1)
+    ctr_3_av = sum(ctr_1_3) / len(ctr_1_3)
+    ctr_5_av = sum(ctr_1_5) / len(ctr_1_5)
+
+    ctr_1_value = (ctr_1['clicks'] / ctr_1['impressions']) if ctr_1['clicks'] > 0 else ctr_1_av
+    ctr_3_value = (ctr_3['clicks'] / ctr_3['impressions']) if ctr_3['clicks'] > 0 else ctr_3_av
+    ctr_5_value = (ctr_5['clicks'] / ctr_5['impressions']) if ctr_5['clicks'] > 0 else ctr_5_av
+
+    forecast_1 = round(ctr_1_value * total_demand) if average_position > 1 else total_clicks
+    forecast_3 = round(ctr_3_value * total_demand) if average_position > 3 else total_clicks
+    forecast_5 = round(ctr_5_value * total_demand) if average_position > 5 else total_clicks
+    return forecast_1, forecast_3, forecast_5
+
+
+def forecast_rows(rows, position_data, ctr_data):
+    forecasts = [forecast_clicks(data['average_position'], position_data, data['total_demand'], data['total_clicks'], ctr_data)
+                 for data in rows]
+    return [list(column) for column in zip(*forecasts)] or [[], [], []]
+
+
+def timed(function, *args):
+    start = time.perf_counter()
+    result = function(*args)
+    return result, time.perf_counter() - start
+
+
+def aggregate(function, pages):
+    position_data = defaultdict(lambda: {'clicks': 0, 'impressions': 0})
+    for items in pages:
+        function(items, position_data)
+    return position_data
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--queries', type=int, default=20000, help='запросов на URL, в среднем')
+    parser.add_argument('--days', type=int, default=30)
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args()
+
+    items = Dataset(urls_per_host=1, queries_per_url=args.queries, days=args.days, seed=args.seed).page_rows('https://site0.ru/page0')
+    pages = [items[start:start + 500] for start in range(0, len(items), 500)]
+    query_summary = {}
+    for page in pages:
+        summarize_query_analytics(query_summary, page)
+    rng = random.Random(args.seed)
+    ctr_data = {position: round(rng.uniform(0, 0.5), 2) for position in range(1, 16)}
+    print(f"Строк аналитики: {len(items)}, уникальных запросов: {len(query_summary)}, дней: {args.days}")
+
+    loop_data, loop_time = timed(aggregate, calculate_average_ctr_per_position_loop, pages)
+    batch_data, batch_time = timed(aggregate, calculate_average_ctr_per_position, pages)
+    print(f"CTR по позициям: по строкам {loop_time:.3f} с, bincount {batch_time:.3f} с, "
+          f"быстрее в x{loop_time / batch_time:.1f}, совпадает: {dict(loop_data) == dict(batch_data)}")
+
+    # Строки format_query_analytics нужны обоим вариантам, поэтому собираются вне замера
+    rows = list(format_query_analytics(query_summary))
+    # Второй прогон - без собственного CTR URL, прогноз идет по кривой хоста
+    for label, position_data in (('CTR URL', batch_data), ('кривая хоста', {})):
+        loop_forecasts, loop_time = timed(forecast_rows, rows, position_data, ctr_data)
+        batch_forecasts, batch_time = timed(forecast_clicks_batch, query_summary, position_data, ctr_data)
+        same = loop_forecasts == batch_forecasts and all(
+            type(a) is type(b) for loop_column, batch_column in zip(loop_forecasts, batch_forecasts)
+            for a, b in zip(loop_column, batch_column))
+        print(f"Прогноз ({label}): по строкам {loop_time:.3f} с, пачкой {batch_time:.3f} с, "
+              f"быстрее в x{loop_time / batch_time:.1f}, совпадает: {same}")
+
+
+if __name__ == '__main__':
+    main()
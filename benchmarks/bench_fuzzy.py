@@ -0,0 +1,100 @@
+# Бенчмарк нечеткой склейки в kill_duplicates.py (--fuzzy): кластеризация лемматизированных
+# ключей через MinHash и LSH и склейка строк по группам в merge_duplicates. Ключи синтетические:
+# базовые фразы и их варианты с опечатками, лишними словами и транслитом, лемматизация не замеряется.
+# Полноту поиска кандидатов проверяет полным перебором пар на небольшой выборке.
+# Запуск: python benchmarks/bench_fuzzy.py --keys 1000000 --threshold 0.8
+import argparse
+import os
+import random
+import sys
+import time
+from itertools import combinations
+
+import numpy as np
+import pandas as pd
+
+BENCHMARKS = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.dirname(BENCHMARKS))
+sys.path.insert(0, BENCHMARKS)
+from kill_duplicates import FUZZY_SHINGLE, TRANSLIT, cluster_similar_keys, merge_duplicates
+from bench_merge_duplicates import make_frame
+
+LETTERS = 'абвгдежзийклмнопрстуфхцчшщыьэюя'
+FILLERS = ['купить', 'цена', 'недорого', 'москва', 'отзывы', 'интернет', 'магазин', 'доставка']
+
+
+def make_keys(count, seed=0):
+    # Примерно половина ключей - варианты уже выданных базовых фраз
+    rng = random.Random(seed)
+    vocabulary = [''.join(rng.choice(LETTERS) for _ in range(rng.randint(4, 9))) for _ in range(20000)]
+    keys, bases = [], []
+    while len(keys) < count:
+        if bases and rng.random() < 0.5:
+            words = rng.choice(bases).split()
+            variant = rng.randrange(3)
+            if variant == 0:
+                index = rng.randrange(len(words))
+                word = words[index]
+                position = rng.randrange(len(word))
+                words[index] = word[:position] + rng.choice(LETTERS) + word[position + 1:]
+            elif variant == 1:
+                words.append(rng.choice(FILLERS))
+            else:
+                index = rng.randrange(len(words))
+                words[index] = words[index].translate(TRANSLIT)
+            keys.append(' '.join(sorted(words)))
+        else:
+            phrase = ' '.join(sorted(rng.sample(vocabulary, rng.randint(2, 4))))
+            bases.append(phrase)
+            keys.append(phrase)
+    return pd.Series(keys)
+
+
+def shingles(text):
+    text = f" {text.translate(TRANSLIT)} "
+    return {text[start:start + FUZZY_SHINGLE] for start in range(len(text) - FUZZY_SHINGLE + 1)}
+
+
+def brute_force_recall(keys, threshold):
+    # Все пары выборки с похожестью не ниже порога и доля тех, что оказались в одной группе
+    unique = list(dict.fromkeys(keys))
+    sets = [shingles(key) for key in unique]
+    similar = [(first, second) for first, second in combinations(range(len(unique)), 2)
+               if len(sets[first] & sets[second]) / len(sets[first] | sets[second]) >= threshold]
+    clusters = dict(zip(keys, cluster_similar_keys(pd.Series(keys), threshold)))
+    found = sum(clusters[unique[first]] == clusters[unique[second]] for first, second in similar)
+    return len(similar), found
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--keys', type=int, default=1000000)
+    parser.add_argument('--threshold', type=float, default=0.8)
+    parser.add_argument('--check', type=int, default=3000, help='размер выборки для проверки полным перебором')
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args()
+
+    keys = make_keys(args.keys, args.seed)
+    pairs, found = brute_force_recall(keys[:args.check].tolist(), args.threshold)
+    print(f"Выборка {args.check}: похожих пар по полному перебору {pairs}, найдено в одной группе {found}")
+
+    start = time.perf_counter()
+    clustered = cluster_similar_keys(keys, args.threshold)
+    cluster_time = time.perf_counter() - start
+
+    df, _ = make_frame(len(keys), args.seed)
+    start = time.perf_counter()
+    exact = merge_duplicates(df, keys)
+    exact_time = time.perf_counter() - start
+    start = time.perf_counter()
+    fuzzy = merge_duplicates(df, clustered)
+    fuzzy_time = time.perf_counter() - start
+
+    print(f"Ключей: {len(keys)}, уникальных: {keys.nunique()}, порог: {args.threshold}")
+    print(f"Кластеризация: {cluster_time:.2f} с, {len(keys) / cluster_time:,.0f} ключей/с")
+    print(f"Склейка точная: {exact_time:.2f} с, строк {len(exact)}; с --fuzzy: {fuzzy_time:.2f} с, строк {len(fuzzy)}")
+    print(f"Сумма показов после склейки сохранена: {np.isclose(df['Показы'].sum(), fuzzy['Показы'].sum())}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,89 @@
+# Запись результатов ws.py и их чтение на стадии склейки дублей: query_analytics.csv против
+# query_analytics.parquet (ws.py --parquet). Строки синтетические, пишутся теми же
+# CsvOutput и ParquetOutput, что и в ws.py, по --rows-per-url строк на URL (у обычного URL
+# их десятки). Заодно проверяет, что данные совпадают.
+# Запуск: python benchmarks/bench_intermediate.py --rows 1000000 --rows-per-url 40
+import argparse
+import os
+import random
+import sys
+import tempfile
+import time
+
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+cwd = os.getcwd()
+from ws import CsvOutput, KeywordMatcher, ParquetOutput
+os.chdir(cwd)  # ws.py при импорте переходит в свою папку
+from kill_duplicates import read_collected
+
+
+def make_results(rows, rows_per_url, seed=0):
+    rng = random.Random(seed)
+    for start in range(0, rows, rows_per_url):
+        url = f'https://example.ru/page{start // rows_per_url}'
+        yield url, [{
+            'URL': url,
+            'Запрос': f'запрос {index} купить',
+            'Показы': rng.randint(0, 500),
+            'Клики': rng.randint(0, 100),
+            'Ср. Позиция': rng.randint(1, 50),
+            'Ср. CTR': rng.random(),
+            'Спрос': rng.randint(1, 5000),
+            '% от Спроса': rng.random(),
+            'Прогноз кликов TOP-1': rng.randint(0, 1000),
+            'Прогноз кликов TOP-3': rng.randint(0, 1000),
+            'Прогноз кликов TOP-5': rng.randint(0, 1000),
+        } for index in range(start, min(rows, start + rows_per_url))]
+
+
+def write(output, rows, rows_per_url):
+    matcher = KeywordMatcher(['купить'], [])
+    output.reset()
+    start = time.perf_counter()
+    for _, results in make_results(rows, rows_per_url):
+        output.write(results, matcher)
+    output.close()
+    return time.perf_counter() - start
+
+
+def read(parquet):
+    start = time.perf_counter()
+    df = read_collected(parquet)
+    return df, time.perf_counter() - start
+
+
+def size(path):
+    return os.path.getsize(path)
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--rows', type=int, default=1000000)
+    parser.add_argument('--rows-per-url', type=int, default=40)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as folder:
+        os.chdir(folder)
+        csv_output, parquet_output = CsvOutput(), ParquetOutput()
+        csv_write = write(csv_output, args.rows, args.rows_per_url)
+        parquet_write = write(parquet_output, args.rows, args.rows_per_url)
+        csv_df, csv_read = read(False)
+        parquet_df, parquet_read = read(True)
+        csv_size, parquet_size = size(csv_output.path), size(parquet_output.path)
+        os.chdir(cwd)
+
+        numeric = csv_df.columns[2:11]
+        same = (len(csv_df) == len(parquet_df)
+                and (csv_df['Запрос'].values == parquet_df['Запрос'].values).all()
+                and np.allclose(csv_df[numeric].astype(float), parquet_df[numeric].astype(float), atol=0.005))
+        print(f"Строк: {args.rows}, URL: {-(-args.rows // args.rows_per_url)}")
+        print(f"CSV:     запись {csv_write:.2f} с, чтение {csv_read:.2f} с, размер {csv_size / 2 ** 20:.1f} МБ")
+        print(f"Parquet: запись {parquet_write:.2f} с, чтение {parquet_read:.2f} с, "
+              f"размер {parquet_size / 2 ** 20:.1f} МБ")
+        print(f"Чтение быстрее в x{csv_read / parquet_read:.1f}, данные совпадают: {same}")
+
+
+if __name__ == '__main__':
+    main()
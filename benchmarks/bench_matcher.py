@@ -0,0 +1,88 @@
+# Микробенчмарк проверки брендов и стоп-слов: перебор слов с re.search на каждый запрос
+# против KeywordMatcher из ws.py. Заодно проверяет, что результаты совпадают.
+# Запуск: python benchmarks/bench_matcher.py --queries 20000 --stop-words 3000
+import argparse
+import os
+import random
+import re
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from ws import KeywordMatcher, load_stop_words
+
+
+def match_loop(query_text, brands, stop_words):
+    # Прежняя реализация из save_results_to_csv
+    is_vital = 'Нет'
+    for brand in brands:
+        if brand in query_text:
+            is_vital = 'Да'
+            break
+    stop_word_found = ''
+    for stop_word in stop_words:
+        if re.search(rf'\b{re.escape(stop_word)}\b', query_text):
+            stop_word_found = stop_word
+            break
+    return is_vital, stop_word_found
+
+
+def match_compiled(query_text, matcher):
+    return 'Да' if matcher.is_brand(query_text) else 'Нет', matcher.find_stop_word(query_text)
+
+
+def make_word(rng):
+    syllables = ['ка', 'ро', 'ми', 'на', 'ст', 'по', 'ле', 'ти', 'ов', 'ру']
+    return ''.join(rng.choice(syllables) for _ in range(rng.randint(2, 4)))
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--queries', type=int, default=20000)
+    parser.add_argument('--stop-words', type=int, default=3000)
+    parser.add_argument('--brands', type=int, default=200)
+    parser.add_argument('--loop-sample', type=int, default=500,
+                        help='на скольких запросах замерять прежний перебор (он очень медленный)')
+    args = parser.parse_args()
+
+    rng = random.Random(0)
+    stop_words = load_stop_words('stopwords.txt')
+    stop_words += [make_word(rng) for _ in range(args.stop_words)]
+    # Фразы и перекрывающиеся стоп-слова, на которых важен порядок в списке
+    stop_words += [f"{make_word(rng)} {make_word(rng)}" for _ in range(args.stop_words // 10)]
+    brands = [make_word(rng) for _ in range(args.brands)]
+    queries = []
+    for _ in range(args.queries):
+        words = [make_word(rng) for _ in range(rng.randint(2, 5))]
+        if rng.random() < 0.1:
+            words.append(rng.choice(['site.ru', 'б/у', 'www', 'видео']))
+        queries.append(' '.join(words))
+
+    start = time.perf_counter()
+    matcher = KeywordMatcher(brands, stop_words)
+    build_time = time.perf_counter() - start
+
+    start = time.perf_counter()
+    compiled = [match_compiled(query, matcher) for query in queries]
+    compiled_time = time.perf_counter() - start
+
+    sample = queries[:args.loop_sample]
+    start = time.perf_counter()
+    looped = [match_loop(query, brands, stop_words) for query in sample]
+    loop_time = time.perf_counter() - start
+
+    mismatches = sum(1 for a, b in zip(looped, compiled) if a != b)
+    loop_per_query = loop_time / len(sample)
+    compiled_per_query = compiled_time / len(queries)
+    print(f"Стоп-слов: {len(stop_words)}, брендов: {len(brands)}, запросов: {len(queries)}")
+    print(f"Сборка KeywordMatcher: {build_time * 1000:.1f} мс")
+    print(f"Перебор с re.search: {loop_per_query * 1e6:.1f} мкс на запрос (замер на {len(sample)} запросах)")
+    print(f"KeywordMatcher: {compiled_per_query * 1e6:.1f} мкс на запрос")
+    print(f"Ускорение: x{loop_per_query / compiled_per_query:.0f}")
+    print(f"Расхождений с прежней реализацией: {mismatches}")
+    if mismatches:
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,103 @@
+# Бенчмарк свертки дублей в kill_duplicates.py: прежний цикл по уникальным ключам
+# с маской и pd.concat против merge_duplicates на groupby. Ключи синтетические,
+# лемматизация не замеряется. Заодно проверяет, что результаты совпадают.
+# Запуск: python benchmarks/bench_merge_duplicates.py --rows 100000 1000000
+import argparse
+import os
+import sys
+import time
+
+import numpy as np
+import pandas as pd
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from kill_duplicates import merge_duplicates
+
+
+def merge_duplicates_loop(df, keys):
+    # Прежняя реализация из kill_duplicates.py
+    results = pd.DataFrame(columns=df.columns)
+    for query in keys.unique():
+        similar_queries = df[keys == query]
+        main_query = similar_queries.loc[similar_queries['Спрос'].idxmax(), 'Запрос']
+        result_row = {
+            'URL': similar_queries['URL'].iloc[0],
+            'Запрос': main_query,
+            'Показы': similar_queries['Показы'].sum(),
+            'Клики': similar_queries['Клики'].sum(),
+            'Ср. Позиция': similar_queries['Ср. Позиция'].mean(),
+            'Ср. CTR': similar_queries['Клики'].sum() / similar_queries['Показы'].sum() if similar_queries['Показы'].sum() > 0 else 0,
+            'Спрос': similar_queries['Спрос'].max(),
+            '% от Спроса': similar_queries['% от Спроса'].mean(),
+            'Прогноз кликов TOP-1': similar_queries['Прогноз кликов TOP-1'].sum(),
+            'Прогноз кликов TOP-3': similar_queries['Прогноз кликов TOP-3'].sum(),
+            'Прогноз кликов TOP-5': similar_queries['Прогноз кликов TOP-5'].sum(),
+            'Брендовый': similar_queries['Брендовый'].iloc[0],
+            'Стоп-слова': similar_queries['Стоп-слова'].iloc[0],
+        }
+        results = pd.concat([results, pd.DataFrame([result_row])], ignore_index=True)
+    return results
+
+
+def make_frame(rows, seed=0):
+    rng = np.random.default_rng(seed)
+    groups = max(1, rows // 3)
+    impressions = rng.integers(0, 500, rows).astype(float)
+    clicks = np.floor(impressions * rng.random(rows))
+    df = pd.DataFrame({
+        'URL': [f'https://example.ru/page{i}' for i in rng.integers(0, 1000, rows)],
+        'Запрос': [f'запрос {i}' for i in range(rows)],
+        'Показы': impressions,
+        'Клики': clicks,
+        'Ср. Позиция': rng.integers(1, 50, rows).astype(float),
+        'Ср. CTR': np.round(rng.random(rows), 2),
+        'Спрос': rng.integers(1, 5000, rows).astype(float),
+        '% от Спроса': rng.random(rows),
+        'Прогноз кликов TOP-1': rng.integers(0, 1000, rows).astype(float),
+        'Прогноз кликов TOP-3': rng.integers(0, 1000, rows).astype(float),
+        'Прогноз кликов TOP-5': rng.integers(0, 1000, rows).astype(float),
+        'Брендовый': rng.choice(['Да', 'Нет'], rows),
+        'Стоп-слова': rng.choice(['', 'б/у', 'авито'], rows),
+        'Новый': np.nan,
+    })
+    keys = pd.Series([f'лемма {i}' for i in rng.integers(0, groups, rows)], index=df.index)
+    return df, keys
+
+
+def same_results(expected, actual):
+    expected = expected.reset_index(drop=True)
+    actual = actual.reset_index(drop=True)
+    numeric = expected.columns[2:11]
+    text = ['URL', 'Запрос', 'Брендовый', 'Стоп-слова']
+    return (len(expected) == len(actual)
+            and (expected[text].astype(str).values == actual[text].astype(str).values).all()
+            and np.allclose(expected[numeric].astype(float), actual[numeric].astype(float), equal_nan=True))
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--rows', type=int, nargs='+', default=[100000, 1000000])
+    parser.add_argument('--loop-rows', type=int, default=5000,
+                        help='на скольких строках замерять прежний цикл (он квадратичный)')
+    args = parser.parse_args()
+
+    df, keys = make_frame(args.loop_rows)
+    start = time.perf_counter()
+    expected = merge_duplicates_loop(df, keys)
+    loop_time = time.perf_counter() - start
+    start = time.perf_counter()
+    actual = merge_duplicates(df, keys)
+    groupby_time = time.perf_counter() - start
+    print(f"{args.loop_rows} строк: цикл {loop_time:.2f} с, groupby {groupby_time:.3f} с, "
+          f"ускорение x{loop_time / groupby_time:.0f}, результаты совпадают: {same_results(expected, actual)}")
+
+    for rows in args.rows:
+        df, keys = make_frame(rows)
+        start = time.perf_counter()
+        results = merge_duplicates(df, keys)
+        elapsed = time.perf_counter() - start
+        print(f"{rows} строк -> {len(results)} групп: groupby {elapsed:.2f} с ({rows / elapsed:,.0f} строк/с)")
+
+
+if __name__ == '__main__':
+    main()
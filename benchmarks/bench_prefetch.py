@@ -0,0 +1,94 @@
+# Бенчмарк упреждающей загрузки страниц в get_query_analytics: время скачивания аналитики
+# одного большого URL при разных PREFETCH_DEPTH против локального mock_webmaster.py с задержкой.
+# Мок запускается отдельным процессом, чтобы его разбор и сборка JSON не делили GIL с ws.py.
+# Кэш ответов отключен, ограничитель скорости поднят до --max-rate, чтобы мерить именно ожидание
+# ответов. Заодно проверяет, что строки приходят в том же порядке, что и при загрузке по одной странице.
+# Запуск: python benchmarks/bench_prefetch.py --queries 20000 --latency 300 --depths 1 2 4 8
+import argparse
+import json
+import os
+import socket
+import subprocess
+import sys
+import time
+from urllib.request import urlopen
+
+BENCHMARKS = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.dirname(BENCHMARKS))
+sys.path.insert(0, BENCHMARKS)
+from mock_webmaster import USER_ID
+
+
+def fetch(ws, host_id, path, depth, max_rate):
+    ws.PREFETCH_DEPTH = depth
+    ws.client.limiter = ws.RateLimiter(rate=max_rate, max_rate=max_rate)
+    start = time.perf_counter()
+    pages = list(ws.get_query_analytics(USER_ID, host_id, path))
+    return pages, time.perf_counter() - start
+
+
+def free_port():
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+
+def start_mock(args):
+    port = free_port()
+    process = subprocess.Popen([sys.executable, os.path.join(BENCHMARKS, 'mock_webmaster.py'), '--port', str(port),
+                                '--urls', '1', '--queries', str(args.queries), '--days', str(args.days),
+                                '--seed', str(args.seed), '--latency', str(args.latency)], stdout=subprocess.DEVNULL)
+    base_url = f'http://127.0.0.1:{port}'
+    for _ in range(100):
+        try:
+            urlopen(f'{base_url}/stats').close()
+            return process, base_url
+        except OSError:
+            time.sleep(0.1)
+    process.kill()
+    raise SystemExit("Не удалось запустить mock_webmaster.py")
+
+
+def server_requests(base_url):
+    with urlopen(f'{base_url}/stats') as response:
+        return json.load(response)['requests']
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--queries', type=int, default=20000, help='запросов на URL, в среднем')
+    parser.add_argument('--days', type=int, default=7, help='дней статистики: чем больше, тем дольше разбор каждой страницы')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--latency', type=float, default=300, help='задержка ответа, мс')
+    parser.add_argument('--depths', type=int, nargs='+', default=[1, 2, 4, 8])
+    parser.add_argument('--max-rate', type=float, default=1000, help='потолок ограничителя скорости, запросов/с')
+    args = parser.parse_args()
+
+    process, base_url = start_mock(args)
+    try:
+        os.environ['WEBMASTER_API_BASE'] = base_url
+        cwd = os.getcwd()
+        import ws  # Адрес API читается при импорте, поэтому импортируем после запуска сервера
+        os.chdir(cwd)
+        ws.client.cache = None
+        host_id = 'https:site0.ru:443'
+        fetch(ws, host_id, '/page0', 1, args.max_rate)  # Прогрев: мок генерирует данные при первом запросе
+
+        reference = None
+        for depth in args.depths:
+            requests_before = server_requests(base_url)
+            pages, elapsed = fetch(ws, host_id, '/page0', depth, args.max_rate)
+            # Отмененные страницы за концом данных могли еще не дойти до мока
+            time.sleep(args.latency / 1000 * 2)
+            requests = server_requests(base_url) - requests_before
+            rows = [item for page in pages for item in page]
+            if reference is None:
+                reference, reference_time = rows, elapsed
+            print(f"PREFETCH_DEPTH={depth}: {elapsed:.2f} с, страниц: {len(pages)}, запросов: {requests}, "
+                  f"быстрее в x{reference_time / elapsed:.1f}, строки совпадают: {rows == reference}")
+    finally:
+        process.terminate()
+
+
+if __name__ == '__main__':
+    main()
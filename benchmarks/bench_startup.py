@@ -0,0 +1,45 @@
+# Время запуска kill_duplicates.py: импорт модуля и загрузка моделей Natasha
+# без кэша эмбеддингов, с пустым кэшем (холодный старт) и с готовым (теплый старт).
+# Каждый замер - в отдельном процессе. Запуск: python benchmarks/bench_startup.py
+import os
+import subprocess
+import sys
+import tempfile
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+MEASURE = '''
+import sys, time
+start = time.perf_counter()
+import kill_duplicates
+imported = time.perf_counter()
+if sys.argv[1] != 'import':
+    kill_duplicates.MODEL_CACHE_FOLDER = None if sys.argv[1] == 'none' else sys.argv[1]
+    kill_duplicates.load_models()
+    kill_duplicates.lemmatize_batch(['купить красные ботинки'])
+print(imported - start, time.perf_counter() - imported)
+'''
+
+
+def measure(mode):
+    output = subprocess.run([sys.executable, '-c', MEASURE, mode], cwd=ROOT, check=True,
+                            capture_output=True, text=True).stdout
+    return [float(value) for value in output.split()]
+
+
+def main():
+    import_time, _ = measure('import')
+    print(f"Импорт модуля без загрузки моделей: {import_time:.2f} с")
+
+    _, load_time = measure('none')
+    print(f"Загрузка моделей без кэша эмбеддингов: {load_time:.2f} с")
+
+    with tempfile.TemporaryDirectory() as cache_folder:
+        _, cold_time = measure(cache_folder)
+        print(f"Холодный старт (кэш эмбеддингов создается): {cold_time:.2f} с")
+        _, warm_time = measure(cache_folder)
+        print(f"Теплый старт (эмбеддинги из кэша через mmap): {warm_time:.2f} с")
+
+
+if __name__ == '__main__':
+    main()
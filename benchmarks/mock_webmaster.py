@@ -0,0 +1,221 @@
+# Локальная замена API Яндекс Вебмастера для бенчмарков и проверок без токена.
+# Отвечает на те же адреса, что использует ws.py: /v4/user/, /hosts/, query-analytics/list
+# (постранично, с offset и limit, фильтром TEXT_MATCH по URL и датами), search-queries/popular
+# и search-queries/all/history. Данные синтетические и зависят только от --seed.
+# Как и в настоящем API, в строках аналитики нет URL посадочной страницы.
+# Запуск: python benchmarks/mock_webmaster.py --port 8765 --latency 50 --error-rate 0.05
+# и затем: WEBMASTER_API_BASE=http://127.0.0.1:8765 python ws.py
+import argparse
+import json
+import random
+import threading
+import time
+from datetime import datetime, timedelta
+from functools import lru_cache
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+from urllib.parse import urlparse, parse_qs
+
+USER_ID = 42
+WORDS = ['купить', 'цена', 'москва', 'недорого', 'отзывы', 'диван', 'диваны', 'угловой', 'угловые', 'кровать',
+         'кровати', 'шкаф', 'шкафы', 'доставка', 'каталог', 'интернет', 'магазин', 'красный', 'красные', 'б/у']
+
+
+class Dataset:
+    # Синтетический аккаунт: hosts хостов site<N>.ru, на каждом urls_per_host страниц,
+    # на каждой около queries_per_url запросов со статистикой за последние days дней
+    def __init__(self, hosts=1, urls_per_host=100, queries_per_url=200, days=30, seed=0):
+        self.hosts = hosts
+        self.urls_per_host = urls_per_host
+        self.queries_per_url = queries_per_url
+        self.days = days
+        self.seed = seed
+        today = datetime.now()
+        self.dates = [(today - timedelta(days=offset)).strftime('%Y-%m-%d') for offset in range(days - 1, -1, -1)]
+
+    def host_names(self):
+        return [f'site{host}.ru' for host in range(self.hosts)]
+
+    def urls(self):
+        return [f'https://{name}/page{page}' for name in self.host_names() for page in range(self.urls_per_host)]
+
+    @lru_cache(maxsize=None)
+    def page_rows(self, url):
+        rng = random.Random(f'{self.seed}:{url}')
+        rows = []
+        for index in range(rng.randint(self.queries_per_url // 2, self.queries_per_url * 3 // 2)):
+            # Небольшой словарь дает перестановки и словоформы - материал для склейки дублей
+            query = ' '.join(rng.sample(WORDS, rng.randint(2, 4)))
+            if rng.random() < 0.5:
+                query += f' {index}'
+            statistics = []
+            for date in self.dates:
+                if rng.random() < 0.3:
+                    continue
+                impressions = rng.randint(1, 200)
+                clicks = rng.randint(0, impressions)
+                statistics += [
+                    {'date': date, 'field': 'IMPRESSIONS', 'value': impressions},
+                    {'date': date, 'field': 'CLICKS', 'value': clicks},
+                    {'date': date, 'field': 'POSITION', 'value': round(rng.uniform(1, 30), 1)},
+                    {'date': date, 'field': 'CTR', 'value': round(100 * clicks / impressions, 2)},
+                    {'date': date, 'field': 'DEMAND', 'value': rng.randint(impressions, impressions * 3)},
+                ]
+            rows.append({'text_indicator': {'type': 'QUERY', 'value': query}, 'statistics': statistics})
+        return rows
+
+    @lru_cache(maxsize=1024)
+    def query_analytics(self, host_name, url_filter, start_date, end_date):
+        # Фильтр TEXT_MATCH по URL ищет подстроку в адресе страницы
+        page_urls = [f'https://{host_name}/page{page}' for page in range(self.urls_per_host)]
+        rows = [row for page_url in page_urls if url_filter is None or url_filter in page_url for row in self.page_rows(page_url)]
+        if start_date <= self.dates[0] and end_date >= self.dates[-1]:
+            return rows
+        # Узкий период (режим --history): оставляем только статистику за нужные дни
+        return [dict(row, statistics=[stat for stat in row['statistics'] if start_date <= stat['date'] <= end_date])
+                for row in rows]
+
+    def popular_queries(self, host_name):
+        rng = random.Random(f'{self.seed}:popular:{host_name}')
+        return [{'query_text': f'запрос {index}',
+                 'indicators': {'AVG_CLICK_POSITION': rng.uniform(1, 20), 'TOTAL_SHOWS': rng.randint(100, 5000),
+                                'TOTAL_CLICKS': rng.randint(0, 100)}}
+                for index in range(500)]
+
+    def history(self, host_name, indicators, start_date, end_date):
+        rng = random.Random(f'{self.seed}:history:{host_name}')
+        values = {date: (rng.randint(1000, 5000), rng.randint(10, 500)) for date in self.dates}
+        return {indicator: [{'date': f'{date}T00:00:00.000+0300', 'value': values[date][indicator == 'TOTAL_CLICKS']}
+                            for date in self.dates if start_date <= date <= end_date]
+                for indicator in indicators}
+
+
+class MockWebmasterServer(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def __init__(self, address, dataset, latency=0.0, error_rate=0.0, seed=0):
+        super().__init__(address, MockWebmasterHandler)
+        self.dataset = dataset
+        self.latency = latency  # Задержка ответа, в секундах
+        self.error_rate = error_rate  # Доля ответов 429/500/503
+        self.random = random.Random(seed)
+        self.lock = threading.Lock()
+        self.requests = 0
+        self.errors = 0
+
+    @property
+    def base_url(self):
+        return f'http://{self.server_address[0]}:{self.server_address[1]}'
+
+
+class MockWebmasterHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+
+    def log_message(self, *args):
+        pass
+
+    def send_json(self, data, status=200, headers=None):
+        body = json.dumps(data, ensure_ascii=False).encode()
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(body)
+
+    def start_request(self):
+        # Общая часть всех запросов: счетчик, задержка и случайные ошибки
+        server = self.server
+        with server.lock:
+            server.requests += 1
+            fail = server.random.random() < server.error_rate
+            status = server.random.choice([429, 500, 503]) if fail else 200
+            if fail:
+                server.errors += 1
+        if server.latency:
+            time.sleep(server.latency)
+        if status == 429:
+            self.send_json({'error_code': 'QUOTA_EXCEEDED'}, 429, {'Retry-After': '1'})
+        elif status != 200:
+            self.send_json({'error_code': 'INTERNAL_ERROR'}, status)
+        return status == 200
+
+    def host_name(self, parts):
+        # /v4/user/<user_id>/hosts/<host_id>/... , host_id вида https:site0.ru:443
+        return parts[5].split(':')[1] if len(parts) > 5 else ''
+
+    def do_GET(self):
+        url = urlparse(self.path)
+        if url.path == '/stats':
+            return self.send_json({'requests': self.server.requests, 'errors': self.server.errors})
+        if not self.start_request():
+            return
+        parts = url.path.split('/')
+        params = parse_qs(url.query)
+        dataset = self.server.dataset
+        if url.path == '/v4/user/':
+            return self.send_json({'user_id': USER_ID})
+        if url.path.endswith('/hosts/'):
+            return self.send_json({'hosts': [{'host_id': f'https:{name}:443', 'ascii_host_url': f'https://{name}/'}
+                                             for name in dataset.host_names()]})
+        if url.path.endswith('/search-queries/popular'):
+            return self.send_json({'queries': dataset.popular_queries(self.host_name(parts))})
+        if url.path.endswith('/search-queries/all/history'):
+            start_date = params.get('date_from', ['0000-00-00'])[0][:10]
+            end_date = params.get('date_to', ['9999-99-99'])[0][:10]
+            indicators = params.get('query_indicator', ['TOTAL_SHOWS'])
+            return self.send_json({'indicators': dataset.history(self.host_name(parts), indicators, start_date, end_date)})
+        self.send_json({'error_code': 'NOT_FOUND'}, 404)
+
+    def do_POST(self):
+        body = json.loads(self.rfile.read(int(self.headers.get('Content-Length', 0))) or b'{}')
+        if not self.start_request():
+            return
+        url = urlparse(self.path)
+        if not url.path.endswith('/query-analytics/list'):
+            return self.send_json({'error_code': 'NOT_FOUND'}, 404)
+        text_filters = body.get('filters', {}).get('text_filters', [])
+        url_filter = text_filters[0]['value'] if text_filters else None
+        rows = self.server.dataset.query_analytics(self.host_name(url.path.split('/')), url_filter,
+                                                   body.get('start_date', '0000-00-00'), body.get('end_date', '9999-99-99'))
+        offset, limit = body.get('offset', 0), body.get('limit', 500)
+        self.send_json({'text_indicator_to_statistics': rows[offset:offset + limit]})
+
+
+def start_server(dataset, port=0, latency=0.0, error_rate=0.0, seed=0):
+    # Запускает сервер в фоновом потоке; port=0 - любой свободный порт (см. server.base_url)
+    server = MockWebmasterServer(('127.0.0.1', port), dataset, latency, error_rate, seed)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+def add_dataset_arguments(parser):
+    parser.add_argument('--hosts', type=int, default=1)
+    parser.add_argument('--urls', type=int, default=100, help='страниц на хост')
+    parser.add_argument('--queries', type=int, default=200, help='запросов на страницу, в среднем')
+    parser.add_argument('--days', type=int, default=30)
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--latency', type=float, default=0, help='задержка ответа, мс')
+    parser.add_argument('--error-rate', type=float, default=0, help='доля ответов 429/500/503')
+
+
+def make_dataset(args):
+    return Dataset(args.hosts, args.urls, args.queries, args.days, args.seed)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Локальная замена API Яндекс Вебмастера')
+    parser.add_argument('--port', type=int, default=8765)
+    add_dataset_arguments(parser)
+    args = parser.parse_args()
+
+    server = MockWebmasterServer(('127.0.0.1', args.port), make_dataset(args), args.latency / 1000, args.error_rate, args.seed)
+    print(f"API на {server.base_url}, запустите ws.py с WEBMASTER_API_BASE={server.base_url}")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == '__main__':
+    main()
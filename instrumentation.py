@@ -0,0 +1,119 @@
+# Замеры по стадиям для ws.py и kill_duplicates.py: таймеры, счетчики и гистограммы задержек.
+# Пока замеры не включены (stats.enabled), все вызовы почти ничего не стоят.
+# Итог в JSON пишется флагом --stats, профиль cProfile - флагом --cprofile
+import cProfile
+import json
+import threading
+import time
+import tracemalloc
+from bisect import bisect_left
+from contextlib import contextmanager, nullcontext
+
+# Границы корзин гистограмм задержек, в миллисекундах
+HISTOGRAM_BOUNDS = [1, 2, 5, 10, 20, 50, 100, 200, 500, 1000, 2000, 5000, 10000]
+
+
+class Stats:
+    def __init__(self):
+        self.enabled = False
+        self.lock = threading.Lock()
+        self.started = time.perf_counter()
+        self.timers = {}
+        self.counters = {}
+        self.histograms = {}
+        self.info = {}
+
+    def enable(self):
+        self.enabled = True
+        self.started = time.perf_counter()
+
+    def add_time(self, name, seconds):
+        if not self.enabled:
+            return
+        with self.lock:
+            timer = self.timers.setdefault(name, [0, 0.0, 0.0])
+            timer[0] += 1
+            timer[1] += seconds
+            timer[2] = max(timer[2], seconds)
+
+    def stage(self, name):
+        # with stats.stage('write'): ... - время блока суммируется в таймер name
+        return self.timed_block(name) if self.enabled else nullcontext()
+
+    @contextmanager
+    def timed_block(self, name):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.add_time(name, time.perf_counter() - start)
+
+    def count(self, name, value=1):
+        if not self.enabled:
+            return
+        with self.lock:
+            self.counters[name] = self.counters.get(name, 0) + value
+
+    def observe(self, name, seconds):
+        # Задержка в гистограмму name и заодно в одноименный таймер
+        if not self.enabled:
+            return
+        bucket = bisect_left(HISTOGRAM_BOUNDS, seconds * 1000)
+        with self.lock:
+            histogram = self.histograms.setdefault(name, [0] * (len(HISTOGRAM_BOUNDS) + 1))
+            histogram[bucket] += 1
+        self.add_time(name, seconds)
+
+    def set_info(self, name, value):
+        if self.enabled:
+            with self.lock:
+                self.info[name] = value
+
+    def summary(self):
+        with self.lock:
+            labels = [f"<={bound}ms" for bound in HISTOGRAM_BOUNDS] + [f">{HISTOGRAM_BOUNDS[-1]}ms"]
+            return {
+                'wall_time': round(time.perf_counter() - self.started, 3),
+                'timers': {name: {'count': count, 'total': round(total, 4), 'max': round(longest, 4),
+                                  'mean': round(total / count, 6) if count else 0}
+                           for name, (count, total, longest) in sorted(self.timers.items())},
+                'counters': dict(sorted(self.counters.items())),
+                'histograms': {name: {label: value for label, value in zip(labels, buckets) if value}
+                               for name, buckets in sorted(self.histograms.items())},
+                'info': dict(self.info),
+            }
+
+    def write(self, path):
+        with open(path, 'w', encoding='utf-8') as file:
+            json.dump(self.summary(), file, ensure_ascii=False, indent=2)
+        print(f"Замеры по стадиям сохранены в {path}")
+
+
+stats = Stats()
+
+
+@contextmanager
+def profiled(stats_path=None, cprofile_path=None, trace_memory=False):
+    # Обертка вокруг всего запуска: включает замеры, cProfile и tracemalloc по флагам
+    # и в конце пишет итоги. cProfile видит только основной поток
+    if stats_path:
+        stats.enable()
+    profiler = cProfile.Profile() if cprofile_path else None
+    if trace_memory:
+        tracemalloc.start()
+    if profiler:
+        profiler.enable()
+    try:
+        yield stats
+    finally:
+        if profiler:
+            profiler.disable()
+            profiler.dump_stats(cprofile_path)
+            print(f"Профиль cProfile сохранен в {cprofile_path} (смотреть: python -m pstats {cprofile_path})")
+        if trace_memory:
+            peak = tracemalloc.get_traced_memory()[1] / 1024 / 1024
+            tracemalloc.stop()
+            stats.set_info('peak_memory_mb', round(peak, 1))
+            print(f"Пиковое потребление памяти: {peak:.1f} МБ")
+        if stats_path:
+            stats.write(stats_path)
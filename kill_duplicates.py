@@ -1,103 +1,387 @@
 import pandas as pd
 import os
 import re
-from natasha import Segmenter, MorphVocab, Doc, NewsEmbedding, NewsMorphTagger
+import json
+import sqlite3
+import argparse
+from concurrent.futures import ProcessPoolExecutor
+from contextlib import nullcontext
+from functools import lru_cache
+from types import SimpleNamespace
 from collections import Counter
 import csv
+import numpy as np
+from instrumentation import stats, profiled
 
-# Настройка пути
 abspath = os.path.abspath(__file__)
 dname = os.path.dirname(abspath)
-os.chdir(dname)
 
-# Инициализация инструментов Natasha
-segmenter = Segmenter()
-morph_vocab = MorphVocab()
-emb = NewsEmbedding()
-morph_tagger = NewsMorphTagger(emb)
+LEMMA_CACHE_DB = 'lemma_cache.sqlite'  # Кэш лемматизации между запусками
+LEMMA_BATCH_SIZE = 256  # Сколько запросов прогоняем через морфологический теггер за раз
+SKIP_POS = ('ADP', 'PART', 'CONJ', 'PRCL')  # Исключаем предлоги, частицы и союзы
+MODEL_CACHE_FOLDER = os.path.join(dname, 'model_cache')  # None - всегда грузить эмбеддинги Natasha заново
+FUZZY_SHINGLE = 3  # Длина символьных n-грамм, по которым сравниваются запросы в режиме --fuzzy
+FUZZY_PERMUTATIONS = 64  # Сколько хэш-функций в подписи MinHash
+FUZZY_CHUNK = 200000  # Сколько пар-кандидатов проверяется за раз
+# Кириллица сравнивается в латинской транслитерации, чтобы "диван" и "divan" совпали
+TRANSLIT = str.maketrans({
+    'а': 'a', 'б': 'b', 'в': 'v', 'г': 'g', 'д': 'd', 'е': 'e', 'ё': 'e', 'ж': 'zh', 'з': 'z', 'и': 'i',
+    'й': 'y', 'к': 'k', 'л': 'l', 'м': 'm', 'н': 'n', 'о': 'o', 'п': 'p', 'р': 'r', 'с': 's', 'т': 't',
+    'у': 'u', 'ф': 'f', 'х': 'h', 'ц': 'c', 'ч': 'ch', 'ш': 'sh', 'щ': 'sch', 'ъ': '', 'ы': 'y', 'ь': '',
+    'э': 'e', 'ю': 'yu', 'я': 'ya',
+})
 
-# Функция для лемматизации и удаления стоп-слов
-def lemmatize(text):
+# Инструменты Natasha загружаются лениво, при первой лемматизации (см. load_models)
+segmenter = None
+morph_vocab = None
+morph_tagger = None
+
+def load_embedding():
+    # Теггеру из эмбеддингов нужны только id модели и два массива PQ. Их копия хранится
+    # в MODEL_CACHE_FOLDER в .npy и читается через mmap - без разбора словаря на 250 тыс. слов
+    # и предвычислений navec, которые NewsEmbedding делает при каждом запуске
+    from natasha import NewsEmbedding
+    from natasha.data import NEWS_EMBEDDING
+
+    if not MODEL_CACHE_FOLDER:
+        return NewsEmbedding()
+
+    source = os.stat(NEWS_EMBEDDING)
+    stamp = f"{os.path.basename(NEWS_EMBEDDING)}:{source.st_size}:{int(source.st_mtime)}"
+    stamp_path = os.path.join(MODEL_CACHE_FOLDER, 'news_embedding.json')
+    indexes_path = os.path.join(MODEL_CACHE_FOLDER, 'news_embedding_indexes.npy')
+    codes_path = os.path.join(MODEL_CACHE_FOLDER, 'news_embedding_codes.npy')
+    try:
+        with open(stamp_path, 'r', encoding='utf-8') as file:
+            cached = json.load(file)
+        if cached['stamp'] == stamp:
+            pq = SimpleNamespace(indexes=np.load(indexes_path, mmap_mode='r'), codes=np.load(codes_path, mmap_mode='r'))
+            return SimpleNamespace(meta=SimpleNamespace(id=cached['id']), pq=pq)
+    except (OSError, ValueError, KeyError):
+        pass  # Кэша еще нет или он поврежден - соберем заново
+
+    emb = NewsEmbedding()
+    os.makedirs(MODEL_CACHE_FOLDER, exist_ok=True)
+    # Каждый файл пишется во временный и подменяется целиком, а отметка - последней:
+    # читатель не увидит недописанный массив, даже если кэш собирают несколько процессов сразу
+    for path, array in ((indexes_path, emb.pq.indexes), (codes_path, emb.pq.codes)):
+        temp_path = f"{path}.{os.getpid()}.tmp"
+        with open(temp_path, 'wb') as file:
+            np.save(file, array)
+        os.replace(temp_path, path)
+    temp_path = f"{stamp_path}.{os.getpid()}.tmp"
+    with open(temp_path, 'w', encoding='utf-8') as file:
+        json.dump({'stamp': stamp, 'id': emb.meta.id}, file)
+    os.replace(temp_path, stamp_path)
+    return emb
+
+def load_models():
+    global segmenter, morph_vocab, morph_tagger
+    if morph_tagger is not None:
+        return
+    from natasha import Segmenter, MorphVocab, NewsMorphTagger
+
+    segmenter = Segmenter()
+    morph_vocab = MorphVocab()
+    tagger = NewsMorphTagger(load_embedding())
+    # Размер пачки внутри теггера: по умолчанию 8 предложений, для коротких запросов это слишком мало
+    tagger.batch_size = LEMMA_BATCH_SIZE
+    tagger.infer.encoder.batch_size = LEMMA_BATCH_SIZE
+    morph_tagger = tagger
+
+def clean_query(text):
     text = re.sub(r'[^\w\s]', ' ', text)    # Заменить спецсимволы на пробелы
     text = re.sub(r'[-,]', ' ', text)  # Заменяет тире и запятые на пробелы
     text = re.sub(r'\s+', ' ', text).strip()    # Заменить множественные пробелы на одиночные и удалить ведущие и конечные пробелы
+    return text
+
+@lru_cache(maxsize=200000)
+def lemmatize_token(text, pos, feats):
+    return morph_vocab.lemmatize(text, pos, dict(feats))
+
+def lemmatize_batch(texts):
+    # Лемматизация пачки запросов за один вызов теггера. Для каждого запроса возвращает
+    # лемматизированный текст с отсортированными словами, без предлогов, частиц и союзов
+    load_models()
+    chunks = [[token.text for token in segmenter.tokenize(clean_query(text))] for text in texts]
+    results = []
+    for markup in morph_tagger.map(chunks):
+        lemmas = [lemmatize_token(token.text, token.pos, tuple(sorted(token.feats.items())))
+                  for token in markup.tokens if token.pos not in SKIP_POS]
+        results.append(" ".join(sorted(lemmas)))
+    return results
+
+
+class LemmaCache:
+    # Запрос -> лемматизированный текст в SQLite, чтобы повторные запуски
+    # не прогоняли через теггер уже встречавшиеся запросы
+    def __init__(self, path=LEMMA_CACHE_DB):
+        self.conn = sqlite3.connect(path)
+        self.conn.execute('CREATE TABLE IF NOT EXISTS lemmas (query TEXT PRIMARY KEY, lemma TEXT)')
+
+    def get_many(self, queries):
+        found = {}
+        for start in range(0, len(queries), 900):
+            chunk = queries[start:start + 900]
+            placeholders = ','.join('?' * len(chunk))
+            found.update(self.conn.execute(f'SELECT query, lemma FROM lemmas WHERE query IN ({placeholders})', chunk))
+        return found
+
+    def set_many(self, lemmas):
+        self.conn.executemany('INSERT OR REPLACE INTO lemmas VALUES (?, ?)', lemmas.items())
+        self.conn.commit()
+
+    def close(self):
+        self.conn.close()
+
+def lemmatize_queries(queries, cache_path=LEMMA_CACHE_DB, workers=1):
+    # Каждый уникальный запрос лемматизируется один раз: сначала ищем его в кэше,
+    # остальные прогоняем через теггер пачками. При workers > 1 пачки распределяются
+    # по процессам (теггер упирается в одно ядро), результаты собираются в исходном порядке
+    unique_queries = [str(query) for query in pd.unique(queries)]
+    cache = LemmaCache(cache_path) if cache_path else None
+    lemmas = cache.get_many(unique_queries) if cache else {}
+    missing = [query for query in unique_queries if query not in lemmas]
+    print(f"Уникальных запросов: {len(unique_queries)}, из кэша: {len(unique_queries) - len(missing)}")
+    stats.count('queries.unique', len(unique_queries))
+    stats.count('queries.cached', len(unique_queries) - len(missing))
+
+    step = LEMMA_BATCH_SIZE * 10
+    batches = [missing[start:start + step] for start in range(0, len(missing), step)]
+    parallel = workers > 1 and len(batches) > 1
+    if parallel:
+        # Кэш эмбеддингов собираем до запуска процессов, чтобы они только читали его через mmap
+        load_embedding()
+    # Каждый процесс загружает модели Natasha один раз, при старте
+    with ProcessPoolExecutor(max_workers=workers, initializer=load_models) if parallel else nullcontext() as executor:
+        batch_results = executor.map(lemmatize_batch, batches) if parallel else map(lemmatize_batch, batches)
+        # При workers > 1 сюда попадает и ожидание результатов процессов
+        with stats.stage('lemmatize.tagger'):
+            batch_results = list(batch_results)
+        for batch, batch_result in zip(batches, batch_results):
+            batch_lemmas = dict(zip(batch, batch_result))
+            lemmas.update(batch_lemmas)
+            if cache:
+                cache.set_many(batch_lemmas)
+
+    if cache:
+        cache.close()
+    return queries.astype(str).map(lemmas)
+
+def sorted_unique(values):
+    # np.unique через сортировку: в numpy 2 он для целых идет через хэш-таблицу, это в разы медленнее
+    values = np.sort(values)
+    return values[np.concatenate(([True], values[1:] != values[:-1]))] if len(values) else values
+
+def shingle_sets(texts):
+    # Множества символьных n-грамм для каждого текста в одном плоском массиве: n-грамма
+    # кодируется числом из кодов символов и хэшируется в 32 бита. Внутри текста значения
+    # уникальны и отсортированы, текст i занимает values[starts[i]:starts[i] + counts[i]]
+    padded = [f" {text.translate(TRANSLIT)} " for text in texts]
+    lengths = np.fromiter(map(len, padded), np.int64, len(padded))
+    codes = np.frombuffer(''.join(padded).encode('utf-32-le'), dtype=np.uint32).astype(np.uint64)
+    counts = np.maximum(lengths - FUZZY_SHINGLE + 1, 0)
+    doc = np.repeat(np.arange(len(padded), dtype=np.uint64), counts)
+    positions = (np.arange(counts.sum()) - np.repeat(np.cumsum(counts) - counts, counts)
+                 + np.repeat(np.cumsum(lengths) - lengths, counts))
+    ids = np.zeros(len(positions), dtype=np.uint64)
+    for offset in range(FUZZY_SHINGLE):
+        ids = (ids << np.uint64(21)) | codes[positions + offset]
+    hashed = (ids * np.uint64(0x9E3779B97F4A7C15)) >> np.uint64(32)
+    keys = sorted_unique((doc << np.uint64(32)) | hashed)
+    values = keys & np.uint64(0xFFFFFFFF)
+    counts = np.bincount((keys >> np.uint64(32)).astype(np.int64), minlength=len(padded))
+    return values, np.cumsum(counts) - counts, counts
+
+def lsh_bands(threshold, permutations=FUZZY_PERMUTATIONS):
+    # Разбиение подписи на bands полос по rows значений: пара с похожестью s попадает
+    # в кандидаты с вероятностью 1 - (1 - s^rows)^bands. Берем самые длинные полосы
+    # (меньше лишних кандидатов), при которых пары на пороге находятся в 95% случаев
+    for rows in sorted((rows for rows in range(1, permutations + 1) if permutations % rows == 0), reverse=True):
+        bands = permutations // rows
+        if 1 - (1 - threshold ** rows) ** bands >= 0.95:
+            return bands, rows
+    return permutations, 1
+
+def minhash_candidates(values, starts, counts, threshold, seed=0):
+    # Пары-кандидаты через MinHash и LSH: для каждой полосы подписи тексты с одинаковым ключом
+    # полосы попадают в одну корзину, внутри корзины соседние (в случайном порядке) тексты
+    # образуют пары. Так пар не больше, чем текстов на полосу, даже в огромных корзинах
+    rng = np.random.default_rng(seed)
+    bands, rows = lsh_bands(threshold)
+    docs = np.flatnonzero(counts)  # Текстам без n-грамм (пустым) склеиваться не с чем
+    if len(docs) < 2:
+        return np.empty(0, dtype=np.int64), np.empty(0, dtype=np.int64)
+    multipliers = rng.integers(1, np.iinfo(np.uint64).max, bands * rows, dtype=np.uint64, endpoint=True) | np.uint64(1)
+    increments = rng.integers(0, np.iinfo(np.uint64).max, bands * rows, dtype=np.uint64, endpoint=True)
+    left, right = [], []
+    for band in range(bands):
+        band_keys = np.zeros(len(docs), dtype=np.uint64)
+        for permutation in range(band * rows, (band + 1) * rows):
+            hashed = (values * multipliers[permutation] + increments[permutation]) >> np.uint64(32)
+            band_keys = band_keys * np.uint64(0x100000001B3) + np.minimum.reduceat(hashed, starts[docs])
+        order = np.lexsort((rng.permutation(len(docs)), band_keys))
+        same = band_keys[order[1:]] == band_keys[order[:-1]]
+        left.append(docs[order[:-1][same]])
+        right.append(docs[order[1:][same]])
+    left, right = np.concatenate(left), np.concatenate(right)
+    pairs = sorted_unique(np.minimum(left, right) * len(counts) + np.maximum(left, right))
+    return pairs // len(counts), pairs % len(counts)
+
+def gather_sets(values, starts, counts, docs):
+    # Значения n-грамм для списка текстов подряд и номер позиции в списке для каждого значения
+    lengths = counts[docs]
+    owners = np.repeat(np.arange(len(docs)), lengths)
+    positions = np.arange(lengths.sum()) - np.repeat(np.cumsum(lengths) - lengths, lengths) + np.repeat(starts[docs], lengths)
+    return owners, values[positions]
+
+def jaccard(values, starts, counts, left, right):
+    # Точная похожесть Жаккара множеств n-грамм для пар (left[i], right[i]): значения обеих
+    # сторон каждой пары сортируются вместе, совпавшие соседи и есть пересечение
+    similarity = np.empty(len(left))
+    for start in range(0, len(left), FUZZY_CHUNK):
+        chunk_left, chunk_right = left[start:start + FUZZY_CHUNK], right[start:start + FUZZY_CHUNK]
+        owners_left, values_left = gather_sets(values, starts, counts, chunk_left)
+        owners_right, values_right = gather_sets(values, starts, counts, chunk_right)
+        keys = np.sort(np.concatenate([(owners_left.astype(np.uint64) << np.uint64(32)) | values_left,
+                                       (owners_right.astype(np.uint64) << np.uint64(32)) | values_right]))
+        common = keys[1:][keys[1:] == keys[:-1]] >> np.uint64(32)
+        intersection = np.bincount(common.astype(np.int64), minlength=len(chunk_left))
+        union = counts[chunk_left] + counts[chunk_right] - intersection
+        similarity[start:start + FUZZY_CHUNK] = intersection / union
+    return similarity
+
+def cluster_similar_keys(keys, threshold):
+    # Нечеткая склейка (--fuzzy): лемматизированные запросы, похожие по символьным n-граммам
+    # не меньше threshold (похожесть Жаккара), объединяются в группы, в том числе по цепочке.
+    # Кандидаты ищутся через MinHash и LSH примерно за линейное время, каждая пара
+    # проверяется точно. Ключ группы - ключ ее первого по порядку запроса
+    codes, uniques = pd.factorize(keys)
+    values, starts, counts = shingle_sets([str(key) for key in uniques])
+    left, right = minhash_candidates(values, starts, counts, threshold)
+    similar = jaccard(values, starts, counts, left, right) >= threshold
+    stats.count('fuzzy.candidates', len(left))
+    stats.count('fuzzy.similar_pairs', int(similar.sum()))
+
+    # Union-find; корень группы - ее наименьший номер, то есть первый встретившийся ключ
+    parent = list(range(len(uniques)))
+    def find(node):
+        while parent[node] != node:
+            parent[node] = parent[parent[node]]
+            node = parent[node]
+        return node
+    for first, second in zip(left[similar].tolist(), right[similar].tolist()):
+        first, second = find(first), find(second)
+        if first != second:
+            parent[max(first, second)] = min(first, second)
+    roots = np.fromiter((find(node) for node in range(len(uniques))), np.int64, len(uniques))
+    print(f"Нечеткая склейка: пар-кандидатов {len(left)}, похожих пар {int(similar.sum())}, "
+          f"групп {len(np.unique(roots))} вместо {len(uniques)}")
+    return pd.Series(np.asarray(uniques, dtype=object)[roots[codes]], index=keys.index)
+
+def merge_duplicates(df, keys):
+    # Сворачивает строки с одинаковым ключом (лемматизированным запросом) в одну
+    # за один проход groupby. Группы идут в порядке первого появления ключа
+    grouped = df.groupby(keys, sort=False)
+    is_first = ~keys.duplicated()
+    first_rows = df.loc[is_first.values]
+    first_rows.index = keys[is_first].values
+
+    # Основной запрос - с максимальным спросом в группе
+    main_queries = df.loc[grouped['Спрос'].idxmax().values, 'Запрос']
+    main_queries.index = first_rows.index
+
+    sums = grouped[['Показы', 'Клики', 'Прогноз кликов TOP-1', 'Прогноз кликов TOP-3', 'Прогноз кликов TOP-5']].sum()
+    means = grouped[['Ср. Позиция', '% от Спроса']].mean()
+    ctr = (sums['Клики'] / sums['Показы']).where(sums['Показы'] > 0, 0)
+
+    results = pd.DataFrame({
+        'URL': first_rows['URL'],
+        'Запрос': main_queries,
+        'Показы': sums['Показы'],
+        'Клики': sums['Клики'],
+        'Ср. Позиция': means['Ср. Позиция'],
+        'Ср. CTR': ctr,
+        'Спрос': grouped['Спрос'].max(),
+        '% от Спроса': means['% от Спроса'],
+        'Прогноз кликов TOP-1': sums['Прогноз кликов TOP-1'],
+        'Прогноз кликов TOP-3': sums['Прогноз кликов TOP-3'],
+        'Прогноз кликов TOP-5': sums['Прогноз кликов TOP-5'],
+        'Брендовый': first_rows['Брендовый'],
+        'Стоп-слова': first_rows['Стоп-слова'],
+    }, index=first_rows.index)
+    return results.reindex(columns=df.columns).reset_index(drop=True)
+
+def read_collected(parquet=False):
+    if parquet:
+        # Файл Parquet от ws.py --parquet: столбцы уже типизированы, разбирать текст не нужно
+        try:
+            return pd.read_parquet('query_analytics.parquet')
+        except ImportError:
+            raise SystemExit("Для режима --parquet нужен пакет pyarrow: pip install pyarrow")
+
+    # Загрузка данных: числа в файле записаны с десятичной запятой и разбираются сразу при чтении
+    return pd.read_csv('query_analytics.csv', delimiter=';', decimal=',')
+
+def main(workers=1, parquet=False, fuzzy=None):
+    source = 'query_analytics.parquet' if parquet else 'query_analytics.csv'
+    if not os.path.exists(source):
+        print(f"{source} не найден, сначала запустите ws.py" + (" --parquet" if parquet else ""))
+        return
+
+    with stats.stage('read'):
+        df = read_collected(parquet)
+    stats.count('rows.in', len(df))
+
+    # Преобразование числовых столбцов
+    numeric_columns = ['Показы', 'Клики', 'Ср. Позиция', 'Ср. CTR', 'Спрос',
+                       '% от Спроса', 'Прогноз кликов TOP-1', 'Прогноз кликов TOP-3', 'Прогноз кликов TOP-5']
+
+    df[numeric_columns] = df[numeric_columns].astype(float)
+
+    # Обработка дублей
+    with stats.stage('lemmatize'):
+        lemmatized_queries = lemmatize_queries(df['Запрос'], workers=workers)
+    if fuzzy is not None:
+        with stats.stage('fuzzy'):
+            lemmatized_queries = cluster_similar_keys(lemmatized_queries, fuzzy)
+    with stats.stage('merge'):
+        results = merge_duplicates(df, lemmatized_queries)
+    stats.count('rows.out', len(results))
+
+    # Сохранить результаты в новый файл без кавычек, числа - с двумя знаками и запятой
+    with stats.stage('write'):
+        results.to_csv('query_analytics_lemmatization.csv', index=False, sep=';', encoding='utf-8-sig', quoting=csv.QUOTE_NONE, escapechar='\\',
+                       float_format='%.2f', decimal=',')
+
+def parse_threshold(value):
+    threshold = float(value)
+    if not 0 < threshold <= 1:
+        raise argparse.ArgumentTypeError(f"порог похожести должен быть больше 0 и не больше 1: {value}")
+    return threshold
+
+def parse_args():
+    parser = argparse.ArgumentParser(description='Склейка дублей запросов по леммам')
+    parser.add_argument('--workers', type=int, default=1,
+                        help='сколько процессов использовать для лемматизации (по умолчанию %(default)s)')
+    parser.add_argument('--parquet', action='store_true',
+                        help='читать результаты ws.py --parquet из query_analytics.parquet вместо CSV')
+    parser.add_argument('--fuzzy', metavar='THRESHOLD', type=parse_threshold,
+                        help='склеивать и похожие запросы: опечатки, лишние слова, транслит. '
+                             'THRESHOLD - порог похожести от 0 до 1, например 0.8')
+    parser.add_argument('--stats', metavar='FILE',
+                        help='замерить время стадий и сохранить итог в FILE (JSON)')
+    parser.add_argument('--cprofile', metavar='FILE',
+                        help='снять профиль cProfile и сохранить его в FILE')
+    parser.add_argument('--memory', '--tracemalloc', action='store_true',
+                        help='отслеживать пиковое потребление памяти и вывести его в конце (замедляет работу)')
+    return parser.parse_args()
 
-    doc = Doc(text)
-    doc.segment(segmenter)
-    doc.tag_morph(morph_tagger)
-    lemmas = []
-    for token in doc.tokens:
-        token.lemmatize(morph_vocab)
-        if token.pos not in ('ADP', 'PART', 'CONJ', 'PRCL'):  # Исключаем предлоги, частицы и союзы
-            lemmas.append(token.lemma)
-    return " ".join(sorted(lemmas))  # Возвращаем лемматизированный текст с отсортированными словами
-
-# Загрузка данных
-df = pd.read_csv('query_analytics.csv', delimiter=';')
-
-# Преобразование числовых столбцов
-numeric_columns = ['Показы', 'Клики', 'Ср. Позиция', 'Ср. CTR', 'Спрос', 
-                   '% от Спроса', 'Прогноз кликов TOP-1', 'Прогноз кликов TOP-3', 'Прогноз кликов TOP-5']
-
-df[numeric_columns] = df[numeric_columns].replace({',': '.'}, regex=True).astype(float)
-
-# Обработка дублей
-results = pd.DataFrame(columns=df.columns)
-lemmatized_queries = df['Запрос'].apply(lemmatize)  # Здесь функция lemmatize - это ваша функция лемматизации
-
-for query in lemmatized_queries.unique():
-    similar_queries = df[lemmatized_queries == query]
-    
-    # Выбор основного запроса на основе максимального значения спроса
-    main_query = similar_queries.loc[similar_queries['Спрос'].idxmax(), 'Запрос']
-    
-    # Подсчет сумм и средних значений
-    result_row = {
-        'URL': similar_queries['URL'].iloc[0],
-        'Запрос': main_query,
-        'Показы': similar_queries['Показы'].sum(),
-        'Клики': similar_queries['Клики'].sum(),
-        'Ср. Позиция': similar_queries['Ср. Позиция'].mean(),
-        'Ср. CTR': similar_queries['Клики'].sum() / similar_queries['Показы'].sum() if similar_queries['Показы'].sum() > 0 else 0,
-        'Спрос': similar_queries['Спрос'].max(),
-        '% от Спроса': similar_queries['% от Спроса'].mean(),
-        'Прогноз кликов TOP-1': similar_queries['Прогноз кликов TOP-1'].sum(),
-        'Прогноз кликов TOP-3': similar_queries['Прогноз кликов TOP-3'].sum(),
-        'Прогноз кликов TOP-5': similar_queries['Прогноз кликов TOP-5'].sum(),
-        'Брендовый': similar_queries['Брендовый'].iloc[0],
-        'Стоп-слова': similar_queries['Стоп-слова'].iloc[0],
-    }
-    
-    results = pd.concat([results, pd.DataFrame([result_row])], ignore_index=True)
-
-# Сохранить результаты в новый файл без кавычек
-results.to_csv('query_analytics_lemmatization.csv', index=False, sep=';', encoding='utf-8-sig', quoting=csv.QUOTE_NONE, escapechar='\\')
-
-# Заменить точки на запятые только в числовых строках, сохраняя URL
-with open('query_analytics_lemmatization.csv', 'r', encoding='utf-8-sig') as file:
-    lines = file.readlines()
-
-header = lines[0]
-processed_lines = [header]
-
-for line in lines[1:]:
-    parts = line.split(';')
-    url = parts[0]  # Сохраняем URL как есть
-    
-    # Обрабатываем остальные части
-    for i in range(1, len(parts)):
-        if i in [2, 3, 4, 5, 6, 7, 8, 9, 10]:  # Индексы числовых столбцов
-            # Если это число с точкой, форматируем его
-            if '.' in parts[i]:
-                try:
-                    num = float(parts[i])
-                    parts[i] = f"{num:.2f}".replace('.', ',')
-                except:
-                    pass
-            parts[i] = parts[i].replace("'", "").replace('"', '')
-    
-    new_line = ';'.join(parts)
-    processed_lines.append(new_line)
-
-with open('query_analytics_lemmatization.csv', 'w', encoding='utf-8-sig') as file:
-    file.writelines(processed_lines)
+if __name__ == "__main__":
+    # Настройка пути
+    os.chdir(dname)
+    args = parse_args()
+    with profiled(args.stats, args.cprofile, args.memory):
+        stats.set_info('options', {'workers': args.workers, 'parquet': args.parquet, 'fuzzy': args.fuzzy})
+        with stats.stage('main'):
+            main(workers=args.workers, parquet=args.parquet, fuzzy=args.fuzzy)
@@ -1,11 +1,23 @@
 import requests
+from requests.adapters import HTTPAdapter
 import csv
 from datetime import datetime, timedelta
 from urllib.parse import urlparse
-from collections import defaultdict
+from collections import defaultdict, deque
+from itertools import zip_longest, islice
 import os
 import re
-import pandas as pd
+import time
+import threading
+import json
+import sqlite3
+import hashlib
+import argparse
+import random
+from email.utils import parsedate_to_datetime
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+import numpy as np
+from instrumentation import stats, profiled
 
 abspath = os.path.abspath(__file__)
 dname = os.path.dirname(abspath)
@@ -25,12 +37,247 @@ def read_access_token(file_path):
 ACCESS_TOKEN_FILE = 'access_token.txt'
 ACCESS_TOKEN = read_access_token(ACCESS_TOKEN_FILE)    
 
-USER_API_URL = 'https://api.webmaster.yandex.net/v4/user/'
-HOSTS_API_URL = 'https://api.webmaster.yandex.net/v4/user/{user_id}/hosts/'
-QUERIES_API_URL = 'https://api.webmaster.yandex.net/v4/user/{user_id}/hosts/{host_id}/query-analytics/list'
-SEARCH_QUERIES_HISTORY_API_URL = 'https://api.webmaster.yandex.net/v4/user/{user_id}/hosts/{host_id}/search-queries/all/history'
+# Адрес API можно подменить переменной окружения, например на локальный benchmarks/mock_webmaster.py
+API_BASE = os.environ.get('WEBMASTER_API_BASE', 'https://api.webmaster.yandex.net').rstrip('/')
+USER_API_URL = API_BASE + '/v4/user/'
+HOSTS_API_URL = API_BASE + '/v4/user/{user_id}/hosts/'
+QUERIES_API_URL = API_BASE + '/v4/user/{user_id}/hosts/{host_id}/query-analytics/list'
+SEARCH_QUERIES_HISTORY_API_URL = API_BASE + '/v4/user/{user_id}/hosts/{host_id}/search-queries/all/history'
+POPULAR_QUERIES_API_URL = API_BASE + '/v4/user/{user_id}/hosts/{host_id}/search-queries/popular'
 URLS_FILE = 'urls.txt'
 OUTPUT_CSV = 'query_analytics.csv'
+OUTPUT_PARQUET = 'query_analytics.parquet'  # Файл Parquet для режима --parquet
+PARQUET_ROW_GROUP = 65536  # Сколько строк копится в памяти до записи очередной группы строк Parquet
+PROJECTS_FOLDER = 'Projects'  # Запросы проектов по доменам для столбца "Новый"
+ANALYTICS_DAYS = 30  # За сколько последних дней собирается аналитика
+HISTORY_DB = 'history.sqlite'  # Подневная статистика для режима --history
+HISTORY_SETTLE_DAYS = 3  # Последние дни Вебмастер еще дозаполняет, в режиме --history они скачиваются при каждом запуске
+MAX_WORKERS = 8  # Сколько URL обрабатываем одновременно
+SUBMIT_WINDOW = MAX_WORKERS * 2  # Сколько задач одновременно стоит в пуле: результаты держатся в памяти только до записи
+PREFETCH_DEPTH = 4  # Сколько страниц аналитики одного URL запрашиваем одновременно (1 - строго по очереди)
+API_TIMEOUT = 60  # Таймаут одного запроса к API, в секундах
+CACHE_DB = 'api_cache.sqlite'  # Локальный кэш ответов API
+CACHE_TTL = 24 * 60 * 60  # Сколько секунд ответ из кэша считается актуальным
+API_RATE = 10  # Стартовая скорость, запросов в секунду
+API_MIN_RATE = 0.5  # Ниже этой скорости ограничитель не опускается
+API_MAX_RATE = 50  # Выше этой скорости ограничитель не поднимается
+API_MAX_RETRIES = 5  # Сколько раз повторять запрос при 429, 5xx и сетевых ошибках
+API_BACKOFF = 1  # Базовая пауза перед повтором, в секундах (удваивается с каждой попыткой)
+
+
+class ResponseCache:
+    # Кэш успешных ответов API в SQLite. Ключ - метод, адрес (в нем user_id и host_id)
+    # и параметры запроса (путь URL, даты, offset), поэтому повторный запуск,
+    # в котором поменялись только бренды или стоп-слова, обходится без сети
+    def __init__(self, path=CACHE_DB, ttl=CACHE_TTL):
+        self.path = path
+        self.ttl = ttl
+        self.refresh = False  # True - не читать из кэша, только обновлять его
+        self.conn = None
+        self.lock = threading.Lock()
+
+    def connect(self):
+        if self.conn is None:
+            self.conn = sqlite3.connect(self.path, check_same_thread=False)
+            self.conn.execute('CREATE TABLE IF NOT EXISTS responses (key TEXT PRIMARY KEY, created REAL, body TEXT)')
+            # В ключе есть даты периода, поэтому каждый день добавляет новую копию всех страниц.
+            # Устаревшие ответы удаляем при открытии: освобожденное место SQLite займет новыми
+            deleted = self.conn.execute('DELETE FROM responses WHERE created < ?', (time.time() - self.ttl,)).rowcount
+            self.conn.commit()
+            if deleted:
+                stats.count('api.cache_purged', deleted)
+        return self.conn
+
+    def make_key(self, token, method, url, **kwargs):
+        token_hash = hashlib.sha1(str(token).encode()).hexdigest()[:12]
+        return json.dumps([token_hash, method, url, kwargs.get('params'), kwargs.get('json')],
+                          sort_keys=True, ensure_ascii=False)
+
+    def get(self, key):
+        if self.refresh:
+            return None
+        with self.lock:
+            row = self.connect().execute('SELECT created, body FROM responses WHERE key = ?', (key,)).fetchone()
+        if row and time.time() - row[0] < self.ttl:
+            return json.loads(row[1])
+        return None
+
+    def set(self, key, data):
+        with self.lock:
+            conn = self.connect()
+            conn.execute('INSERT OR REPLACE INTO responses VALUES (?, ?, ?)',
+                         (key, time.time(), json.dumps(data, ensure_ascii=False)))
+            conn.commit()
+
+
+class CachedResponse:
+    # Ответ из кэша с тем же интерфейсом, что и у requests.Response
+    status_code = 200
+
+    def __init__(self, data):
+        self.data = data
+        self.text = json.dumps(data, ensure_ascii=False)
+
+    def json(self):
+        return self.data
+
+
+class FailedResponse:
+    # Запрос так и не удался из-за сетевой ошибки - отдаем ее как ответ с ошибкой
+    status_code = None
+
+    def __init__(self, error):
+        self.text = str(error)
+
+
+class RateLimiter:
+    # Общий для всех потоков token bucket. Скорость подстраивается сама:
+    # каждый успешный ответ понемногу ее поднимает, ответ 429 снижает вдвое,
+    # а Retry-After приостанавливает все запросы на указанное время
+    def __init__(self, rate=API_RATE, min_rate=API_MIN_RATE, max_rate=API_MAX_RATE):
+        self.rate = rate
+        self.min_rate = min_rate
+        self.max_rate = max_rate
+        self.tokens = 1.0
+        self.updated = time.monotonic()
+        self.paused_until = 0.0
+        self.lock = threading.Lock()
+        self.requests = 0
+        self.retries = 0
+        self.throttled = 0
+        self.throttled_time = 0.0  # Ожидание из-за 429 и Retry-After, сумма по всем потокам
+        self.pacing_time = 0.0  # Обычное ожидание токена при текущей скорости, сумма по всем потокам
+        self.backoff_time = 0.0  # Паузы перед повтором после 5xx и сетевых ошибок, сумма по всем потокам
+
+    def acquire(self):
+        while True:
+            with self.lock:
+                now = time.monotonic()
+                self.tokens = min(max(1.0, self.rate), self.tokens + (now - self.updated) * self.rate)
+                self.updated = now
+                if now >= self.paused_until and self.tokens >= 1:
+                    self.tokens -= 1
+                    self.requests += 1
+                    return
+                pause = max(0.0, self.paused_until - now)
+                wait = max(pause, (1 - self.tokens) / self.rate)
+                self.throttled_time += pause
+                self.pacing_time += wait - pause
+            time.sleep(wait)
+
+    def on_success(self):
+        with self.lock:
+            self.rate = min(self.max_rate, self.rate + 1 / self.rate)
+
+    def on_throttle(self, retry_after=None):
+        with self.lock:
+            self.throttled += 1
+            self.rate = max(self.min_rate, self.rate / 2)
+            if retry_after:
+                self.paused_until = max(self.paused_until, time.monotonic() + retry_after)
+
+    def on_retry(self, delay, throttled=False):
+        # throttled - повтор после 429, пауза идет в ожидание из-за лимитов
+        with self.lock:
+            self.retries += 1
+            if throttled:
+                self.throttled_time += delay
+            else:
+                self.backoff_time += delay
+
+    def report(self):
+        return (f"Запросов к API: {self.requests}, повторов: {self.retries}, ответов 429: {self.throttled}, "
+                f"ожидание из-за лимитов: {self.throttled_time:.1f} с, ожидание по скорости: {self.pacing_time:.1f} с, "
+                f"паузы после ошибок: {self.backoff_time:.1f} с (сумма по потокам), итоговая скорость: {self.rate:.1f} запр./с")
+
+
+def parse_retry_after(value):
+    # Retry-After бывает числом секунд или HTTP-датой
+    if not value:
+        return None
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+    try:
+        return max(0.0, parsedate_to_datetime(value).timestamp() - time.time())
+    except (TypeError, ValueError):
+        return None
+
+
+class WebmasterClient:
+    # Одна сессия на весь запуск: keep-alive соединения переиспользуются
+    # между запросами и потоками вместо нового TLS-рукопожатия на каждый вызов
+    def __init__(self, token, pool_size=MAX_WORKERS * PREFETCH_DEPTH, timeout=API_TIMEOUT, cache=None, limiter=None):
+        self.token = token
+        self.timeout = timeout
+        self.cache = cache
+        self.limiter = limiter or RateLimiter()
+        self.session = requests.Session()
+        self.session.headers.update({
+            'Authorization': f'OAuth {token}',
+            'Content-Type': 'application/json',
+            'Accept-Encoding': 'gzip, deflate'
+        })
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=pool_size)
+        self.session.mount('https://', adapter)
+        self.session.mount('http://', adapter)
+
+    def request(self, method, url, cached=False, **kwargs):
+        key = None
+        if cached and self.cache is not None:
+            key = self.cache.make_key(self.token, method, url, **kwargs)
+            data = self.cache.get(key)
+            if data is not None:
+                stats.count('api.cache_hits')
+                return CachedResponse(data)
+
+        kwargs.setdefault('timeout', self.timeout)
+        response = self.send(method, url, **kwargs)
+        if key is not None and response.status_code == 200:
+            self.cache.set(key, response.json())
+        return response
+
+    def send(self, method, url, **kwargs):
+        # Повторяем запрос при 429, 5xx и сетевых ошибках с экспоненциальной паузой и джиттером
+        for attempt in range(API_MAX_RETRIES + 1):
+            with stats.stage('api.limiter_wait'):
+                self.limiter.acquire()
+            retry_after = None
+            start = time.perf_counter()
+            try:
+                response = self.session.request(method, url, **kwargs)
+            except requests.RequestException as e:
+                response = FailedResponse(e)
+            stats.observe('api.request', time.perf_counter() - start)
+            stats.count(f'api.status.{response.status_code or "network_error"}')
+            if response.status_code is not None:
+                if response.status_code == 429:
+                    retry_after = parse_retry_after(response.headers.get('Retry-After'))
+                    self.limiter.on_throttle(retry_after)
+                elif response.status_code < 500:
+                    # Скорость поднимаем только за успешные ответы: 403 или 404 не говорят, что лимит не достигнут
+                    if 200 <= response.status_code < 300:
+                        self.limiter.on_success()
+                    return response
+
+            if attempt == API_MAX_RETRIES:
+                break
+            delay = retry_after if retry_after is not None else random.uniform(0, API_BACKOFF * 2 ** attempt)
+            self.limiter.on_retry(delay, response.status_code == 429)
+            time.sleep(delay)
+        return response
+
+    def get(self, url, cached=False, **kwargs):
+        return self.request('GET', url, cached, **kwargs)
+
+    def post(self, url, cached=False, **kwargs):
+        return self.request('POST', url, cached, **kwargs)
+
+client = WebmasterClient(ACCESS_TOKEN, cache=ResponseCache())
+# Отдельный пул для упреждающей загрузки страниц: задачи в него ставят потоки основного пула,
+# поэтому общий пул здесь привел бы к взаимной блокировке
+page_executor = ThreadPoolExecutor(max_workers=MAX_WORKERS * PREFETCH_DEPTH, thread_name_prefix='page')
 
 
 def load_brand_names(file_path):
@@ -52,11 +299,7 @@ def load_stop_words(file_path):
         return []
 
 def get_user_id():
-    headers = {
-        'Authorization': f'OAuth {ACCESS_TOKEN}',
-        'Content-Type': 'application/json'
-    }
-    response = requests.get(USER_API_URL, headers=headers)
+    response = client.get(USER_API_URL, cached=True)
     if response.status_code == 200:
         user_info = response.json()
         print (user_info.get('user_id'))
@@ -66,111 +309,178 @@ def get_user_id():
         return None
 
 def get_hosts_list(user_id):
-    headers = {
-        'Authorization': f'OAuth {ACCESS_TOKEN}',
-        'Content-Type': 'application/json'
-    }
     full_url = HOSTS_API_URL.format(user_id=user_id)
-    response = requests.get(full_url, headers=headers)
+    response = client.get(full_url, cached=True)
     if response.status_code == 200:
         return response.json().get('hosts', [])
     else:
         print(f"Ошибка при получении списка хостов: {response.status_code} - {response.text}")
         return None
 
-def get_host_id_for_url(hosts, url):
-    clean_url = url.replace('https://', '').replace('http://', '').strip('/')
-    for host in hosts:
-        if clean_url in host['ascii_host_url']:
-            return host['host_id']
-    return None
+class HostIndex:
+    # Поиск host_id по URL за O(1): индекс строится один раз из списка хостов.
+    # Ключ - схема и хост в нижнем регистре и в punycode, как ascii_host_url в API
+    # (с портом, если он не стандартный). Правила:
+    # 1) точное совпадение схемы и хоста;
+    # 2) тот же хост с другой схемой (http вместо https и наоборот);
+    # 3) то же самое для варианта с www и без www.
+    # Другие поддомены не подходят: shop.ru не найдет myshop.ru или m.shop.ru
+    def __init__(self, hosts):
+        self.by_key = {}
+        self.by_name = {}
+        for host in hosts:
+            scheme, name = self.normalize(host['ascii_host_url'])
+            if name is None:
+                continue
+            self.by_key.setdefault((scheme, name), host['host_id'])
+            self.by_name.setdefault(name, host['host_id'])
+
+    @staticmethod
+    def normalize(url):
+        # Для URL с некорректным портом или именем хоста возвращает (схема, None)
+        if '//' not in url:
+            url = '//' + url
+        parsed = urlparse(url.strip())
+        scheme = parsed.scheme.lower() or 'https'
+        try:
+            # Кириллический домен (пример.рф) приводим к xn--...: в ascii_host_url он в punycode
+            name = (parsed.hostname or '').rstrip('.').encode('idna').decode()
+            port = parsed.port
+        except ValueError:  # В том числе UnicodeError от кодека idna
+            return scheme, None
+        if port and port != {'http': 80, 'https': 443}.get(scheme):
+            name = f"{name}:{port}"
+        return scheme, name
+
+    def find(self, url):
+        scheme, name = self.normalize(url)
+        if name is None:
+            return None
+        alias = name[4:] if name.startswith('www.') else 'www.' + name
+        for candidate in (name, alias):
+            host_id = self.by_key.get((scheme, candidate)) or self.by_name.get(candidate)
+            if host_id:
+                return host_id
+        return None
 
 
 def get_popular_queries_ctr(user_id, host_id):
-    headers = {
-        'Authorization': f'OAuth {ACCESS_TOKEN}',
-        'Content-Type': 'application/json'
-    }
-    url = f'https://api.webmaster.yandex.net/v4/user/{user_id}/hosts/{host_id}/search-queries/popular'
+    url = POPULAR_QUERIES_API_URL.format(user_id=user_id, host_id=host_id)
     params = {
         'query_indicator': ['AVG_CLICK_POSITION', 'TOTAL_SHOWS', 'TOTAL_CLICKS'],
         'order_by': 'TOTAL_CLICKS'  # Сортировка по количеству кликов
     }
-    response = requests.get(url, headers=headers, params=params)
+    response = client.get(url, cached=True, params=params)
     
     if response.status_code == 200:
         # Получаем список популярных запросов
-        items = response.json().get('queries', [])
-        
-        # Инициализируем словарь для хранения CTR по позициям
-        ctr_by_position = {i: {'clicks': 0, 'impressions': 0} for i in range(1, 16)}
-        
-        # Обрабатываем каждый популярный запрос
-        for item in items:
-            # Извлекаем необходимые данные из словаря 'indicators'
-            indicators = item.get('indicators', {})
-            avg_click_position = indicators.get('AVG_CLICK_POSITION', 0)
-            total_shows = indicators.get('TOTAL_SHOWS', 0)
-            total_clicks = indicators.get('TOTAL_CLICKS', 0)
-            
-            # Если avg_click_position имеет значение None, заменяем на 0
-            avg_click_position = avg_click_position or 0
-            
-            # Округляем позицию до ближайшего целого
-            position = round(avg_click_position)
-            
-            # Если позиция находится в диапазоне от 1 до 15, обновляем соответствующую статистику
-            if 1 <= position <= 15:
-                ctr_by_position[position]['clicks'] += total_clicks
-                ctr_by_position[position]['impressions'] += total_shows
-        
-        return items
+        return response.json().get('queries', [])
     else:
         print(f"Ошибка при получении популярных запросов: {response.status_code} - {response.text}")
         return None
 
-def save_ctr_to_csv(ctr_by_position, output_file):
+def calculate_ctr_by_position(popular_queries):
+    # Инициализируем словарь для хранения CTR по позициям
+    ctr_by_position = {i: {'clicks': 0, 'impressions': 0} for i in range(1, 16)}
+
+    for item in popular_queries:
+        indicators = item.get('indicators', {})
+        avg_click_position = indicators.get('AVG_CLICK_POSITION', 0) or 0
+        total_shows = indicators.get('TOTAL_SHOWS', 0)
+        total_clicks = indicators.get('TOTAL_CLICKS', 0)
+        position = round(avg_click_position)
+        if 1 <= position <= 15:
+            ctr_by_position[position]['clicks'] += total_clicks
+            ctr_by_position[position]['impressions'] += total_shows
+    return ctr_by_position
+
+def calculate_ctr_curve(ctr_by_position):
+    # Округляем до сотых, как в ctr.csv, чтобы прогноз не зависел от того, откуда взята кривая
+    return {position: round(data['clicks'] / data['impressions'], 2) if data['impressions'] > 0 else 0
+            for position, data in ctr_by_position.items()}
+
+def save_ctr_curve_to_csv(ctr_data, output_file):
     with open(output_file, 'w', newline='', encoding='utf-8-sig') as csvfile:
-        fieldnames = ['Position', 'Average CTR']
-        writer = csv.DictWriter(csvfile, fieldnames=fieldnames, delimiter=';')
+        writer = csv.DictWriter(csvfile, fieldnames=['Position', 'Average CTR'], delimiter=';')
         writer.writeheader()
-        for position, data in ctr_by_position.items():
-            average_ctr = (data['clicks'] / data['impressions']) if data['impressions'] > 0 else 0
-            writer.writerow({'Position': position, 'Average CTR': f"{average_ctr:.2f}".replace('.', ',')})
-    print(f"Средний CTR для каждой позиции (1-15) сохранен в {output_file}")
+        for position, ctr in ctr_data.items():
+            writer.writerow({'Position': position, 'Average CTR': f"{ctr:.2f}".replace('.', ',')})
 
+CTR_CACHE_TTL = 24 * 60 * 60  # Сколько секунд кривая CTR хоста считается актуальной
+CTR_CACHE_FOLDER = 'ctr_cache'  # None - хранить кривые только в памяти
 
-def process_site_ctr(url, hosts, user_id, output_file):
-    host_id = get_host_id_for_url(hosts, urlparse(url).netloc)
-    # print(f"Получаем CTR для домена: {host_id}")
-    if not host_id:
-        print(f"Не удалось найти host_id для домена: {host_id}")
-        return None
 
-    # Получаем данные о популярных запросах
-    popular_queries = get_popular_queries_ctr(user_id, host_id)
-    
-    # Формируем данные CTR по позициям
-    if popular_queries:
-        # Инициализируем словарь для хранения CTR по позициям
-        ctr_by_position = {i: {'clicks': 0, 'impressions': 0} for i in range(1, 16)}
-
-        for item in popular_queries:
-            indicators = item.get('indicators', {})
-            avg_click_position = indicators.get('AVG_CLICK_POSITION', 0) or 0
-            total_shows = indicators.get('TOTAL_SHOWS', 0)
-            total_clicks = indicators.get('TOTAL_CLICKS', 0)
-            position = round(avg_click_position)
-            if 1 <= position <= 15:
-                ctr_by_position[position]['clicks'] += total_clicks
-                ctr_by_position[position]['impressions'] += total_shows
+class CtrCurveCache:
+    # Кривая CTR по позициям для каждого хоста: скачивается один раз за запуск
+    # и хранится в памяти, при желании - еще и на диске в файле <host_id>_<дата>.csv
+    def __init__(self, ttl=CTR_CACHE_TTL, folder=CTR_CACHE_FOLDER):
+        self.ttl = ttl
+        self.folder = folder
+        self.refresh = False  # True - не читать кривые с диска, только обновлять их
+        self.curves = {}
+        self.host_locks = {}
+        self.lock = threading.Lock()
 
-        # Сохраняем средний CTR по позициям в CSV-файл
-        save_ctr_to_csv(ctr_by_position, output_file)
-    else:
-        print(f"Не удалось получить популярные запросы для домена: {host_id}")
+    def cache_path(self, host_id):
+        file_name = f"{host_id.replace(':', '_')}_{datetime.now().strftime('%Y-%m-%d')}.csv"
+        return os.path.join(self.folder, file_name)
+
+    def cached(self, host_id):
+        with self.lock:
+            cached = self.curves.get(host_id)
+            return cached[1] if cached and time.time() - cached[0] < self.ttl else None
 
-    return host_id
+    def get(self, user_id, host_id):
+        ctr_data = self.cached(host_id)
+        if ctr_data is not None:
+            return ctr_data
+        with self.lock:
+            host_lock = self.host_locks.setdefault(host_id, threading.Lock())
+
+        # Общая блокировка на время скачивания не держится, чтобы хосты не ждали друг друга,
+        # а потоки одного хоста ждут одну загрузку вместо того, чтобы качать кривую повторно
+        with host_lock:
+            ctr_data = self.cached(host_id)
+            if ctr_data is not None:
+                return ctr_data
+            ctr_data = self.load(host_id)
+            if ctr_data is None:
+                popular_queries = get_popular_queries_ctr(user_id, host_id)
+                if popular_queries:
+                    ctr_data = calculate_ctr_curve(calculate_ctr_by_position(popular_queries))
+                    self.save(host_id, ctr_data)
+                else:
+                    print(f"Не удалось получить популярные запросы для домена: {host_id}")
+                    ctr_data = {}
+            with self.lock:
+                self.curves[host_id] = (time.time(), ctr_data)
+            return ctr_data
+
+    def load(self, host_id):
+        if not self.folder or self.refresh:
+            return None
+        path = self.cache_path(host_id)
+        if not os.path.exists(path) or time.time() - os.path.getmtime(path) >= self.ttl:
+            return None
+        return read_ctr_from_csv(path) or None
+
+    def save(self, host_id, ctr_data):
+        if not self.folder:
+            return
+        os.makedirs(self.folder, exist_ok=True)
+        save_ctr_curve_to_csv(ctr_data, self.cache_path(host_id))
+
+ctr_cache = CtrCurveCache()
+
+
+def process_site_ctr(host_id, user_id, output_file):
+    # print(f"Получаем CTR для домена: {host_id}")
+    # Популярные запросы хоста скачиваются один раз, дальше кривая CTR берется из кэша
+    ctr_data = ctr_cache.get(user_id, host_id)
+    if ctr_data:
+        # Сохраняем средний CTR по позициям в CSV-файл
+        save_ctr_curve_to_csv(ctr_data, output_file)
+        print(f"Средний CTR для каждой позиции (1-15) сохранен в {output_file}")
 
 def update_urls_from_yandex_api(api_token, host_id):
     # Define the path to the urls.txt file
@@ -185,9 +495,8 @@ def update_urls_from_yandex_api(api_token, host_id):
         domain = lines[0].strip()
 
         # Make a request to the Yandex Webmaster API to get URLs
-        url = f'https://api.webmaster.yandex.net/v4/user/{host_id}/hosts/{domain}/urls/'
-        headers = {'Authorization': f'OAuth {api_token}'}
-        response = requests.get(url, headers=headers)
+        url = f'{API_BASE}/v4/user/{host_id}/hosts/{domain}/urls/'
+        response = client.get(url, headers={'Authorization': f'OAuth {api_token}'})
 
         if response.status_code == 200:
             urls_data = response.json()
@@ -201,14 +510,27 @@ def update_urls_from_yandex_api(api_token, host_id):
     else:
         print("The file urls.txt does not contain only a single domain line or is already filled with URLs.")
 
-def get_query_analytics(user_id, host_id, target_url):
-    headers = {
-        'Authorization': f'OAuth {ACCESS_TOKEN}',
-        'Content-Type': 'application/json'
-    }
+class WebmasterApiError(Exception):
+    pass
+
+def default_period():
+    # Последние ANALYTICS_DAYS дней, включая сегодня
+    return (datetime.now() - timedelta(days=ANALYTICS_DAYS)).strftime('%Y-%m-%d'), datetime.now().strftime('%Y-%m-%d')
+
+def iter_days(start_date, end_date):
+    day = datetime.strptime(start_date, '%Y-%m-%d')
+    end = datetime.strptime(end_date, '%Y-%m-%d')
+    while day <= end:
+        yield day.strftime('%Y-%m-%d')
+        day += timedelta(days=1)
+
+def get_query_analytics(user_id, host_id, target_url, start_date=None, end_date=None, cached=True):
+    # Генератор: отдает страницы аналитики по мере ответа API, не накапливая их в памяти.
+    # Даты в формате YYYY-MM-DD, по умолчанию - последние ANALYTICS_DAYS дней.
+    # cached=False - не читать и не сохранять страницы в кэше ответов (в режиме --history кэш - это HistoryStore)
     full_url = QUERIES_API_URL.format(user_id=user_id, host_id=host_id)
-    start_date = (datetime.now() - timedelta(days=30)).strftime('%Y-%m-%d')
-    end_date = datetime.now().strftime('%Y-%m-%d')
+    if start_date is None or end_date is None:
+        start_date, end_date = default_period()
     params = {
         'start_date': start_date,
         'end_date': end_date,
@@ -224,25 +546,39 @@ def get_query_analytics(user_id, host_id, target_url):
         }
     }
     # print(f"Запрос аналитики с {start_date} по {end_date} для URL: {target_url}")
-    all_data = []
-    while True:
-        response = requests.post(full_url, headers=headers, json=params)
-        if response.status_code == 200:
-            data = response.json()
-            queries = data.get('text_indicator_to_statistics', [])
-            all_data.extend(queries)
+
+    def fetch_page(offset):
+        response = client.post(full_url, cached=cached, json=dict(params, offset=offset))
+        if response.status_code != 200:
+            raise WebmasterApiError(f"Ошибка при получении запросов поиска: {response.status_code} - {response.text}")
+        return response.json().get('text_indicator_to_statistics', [])
+
+    # Первая страница запрашивается одна: у большинства URL она же последняя. Если она полная,
+    # следующие PREFETCH_DEPTH страниц запрашиваются одновременно (в пределах ограничителя скорости)
+    # и отдаются строго по порядку offset. После неполной страницы еще не начатые
+    # запросы за ее пределами отменяются, а ответы уже отправленных просто не читаются
+    pending = deque()
+    next_offset = 0
+    window = 1
+    try:
+        while True:
+            while len(pending) < window:
+                pending.append(page_executor.submit(fetch_page, next_offset))
+                next_offset += params['limit']
+            queries = pending.popleft().result()
+            stats.count('analytics.pages')
+            stats.count('analytics.rows', len(queries))
+            yield queries
             if len(queries) < params['limit']:
                 break
-            params['offset'] += params['limit']
-        else:
-            print(f"Ошибка при получении запросов поиска: {response.status_code} - {response.text}")
-            return None
-    return {'text_indicator_to_statistics': all_data}
+            window = PREFETCH_DEPTH
+    finally:
+        stats.count('analytics.overshoot_pages', len(pending))
+        for future in pending:
+            future.cancel()
 
-def format_query_analytics(query_analytics):
-    formatted_data = []
-    query_summary = {}
-    for item in query_analytics.get('text_indicator_to_statistics', []):
+def summarize_query_analytics(query_summary, items):
+    for item in items:
         query_text = item.get('text_indicator', {}).get('value', 'Неизвестный запрос')
         stats = item.get('statistics', [])
         if query_text not in query_summary:
@@ -270,11 +606,14 @@ def format_query_analytics(query_analytics):
                 summary['ctr_sum'] += value
             elif field == 'DEMAND':
                 summary['total_demand'] += value
-        
+    return query_summary
+
+def format_query_analytics(query_summary):
+    # Генератор: строки формируются по одной, отдельный список не собирается
     for query_text, summary in query_summary.items():
         average_position = round((summary['position_sum']) / summary['count']) if summary['count'] else 0
         average_ctr = round(summary['ctr_sum'] / (summary['count'] * 100),3) if summary['count'] else 0
-        formatted_data.append({
+        yield {
             'query': query_text,
             'total_impressions': summary['total_impressions'],
             'total_clicks': summary['total_clicks'],
@@ -282,22 +621,186 @@ def format_query_analytics(query_analytics):
             'average_ctr': average_ctr,
             'total_demand': summary['total_demand'],
             'percent_impressions_demand': summary['total_impressions']/summary['total_demand'],
-        })
-    return formatted_data
+        }
 
-def calculate_average_ctr_per_position(query_analytics):
-    position_data = defaultdict(lambda: {'clicks': 0, 'impressions': 0})
-    for item in query_analytics.get('text_indicator_to_statistics', []):
-        stats = item.get('statistics', [])
-        for stat in stats:
-            if stat.get('field') == 'POSITION' and stat.get('value') <= 15:
-                pos = int(stat.get('value'))
-                clicks = next((s['value'] for s in stats if s['field'] == 'CLICKS'), 0)
-                impressions = next((s['value'] for s in stats if s['field'] == 'IMPRESSIONS'), 0)
-                position_data[pos]['clicks'] += clicks
-                position_data[pos]['impressions'] += impressions
+def calculate_average_ctr_per_position(items, position_data=None):
+    # Каждое значение POSITION не ниже 15-й добавляет к своей позиции первые в статистике
+    # запроса CLICKS и IMPRESSIONS. Статистика запроса проходится один раз,
+    # а суммы по позициям для всей страницы считаются через np.bincount
+    if position_data is None:
+        position_data = defaultdict(lambda: {'clicks': 0, 'impressions': 0})
+    positions, clicks, impressions = [], [], []
+    for item in items:
+        item_positions = []
+        first_clicks = first_impressions = None
+        for stat in item.get('statistics', []):
+            field = stat.get('field')
+            if field == 'POSITION':
+                if stat.get('value') <= 15:
+                    item_positions.append(stat.get('value'))
+            elif field == 'CLICKS':
+                if first_clicks is None:
+                    first_clicks = stat['value']
+            elif field == 'IMPRESSIONS':
+                if first_impressions is None:
+                    first_impressions = stat['value']
+        if item_positions:
+            positions += item_positions
+            clicks += [first_clicks or 0] * len(item_positions)
+            impressions += [first_impressions or 0] * len(item_positions)
+    if not positions:
+        return position_data
+
+    # astype отбрасывает дробную часть так же, как int(). Суммы целых счетчиков в float64
+    # точные, поэтому возвращаем их к исходному типу
+    bins = np.asarray(positions).astype(np.int64)
+    clicks, impressions = np.asarray(clicks), np.asarray(impressions)
+    click_sums = np.bincount(bins, weights=clicks).astype(clicks.dtype)
+    impression_sums = np.bincount(bins, weights=impressions).astype(impressions.dtype)
+    for pos in np.flatnonzero(np.bincount(bins)).tolist():
+        position_data[pos]['clicks'] += click_sums[pos].item()
+        position_data[pos]['impressions'] += impression_sums[pos].item()
     return position_data
 
+
+class QueryAnalyticsSummary:
+    # Потоковая свертка аналитики одного URL: страницы API сразу сворачиваются в итоги
+    # по запросам и CTR по позициям и больше не хранятся, поэтому память зависит
+    # только от числа уникальных запросов, а не от объема статистики
+    def __init__(self):
+        self.query_summary = {}
+        self.position_data = defaultdict(lambda: {'clicks': 0, 'impressions': 0})
+
+    def add_page(self, items):
+        with stats.stage('analytics.summarize'):
+            summarize_query_analytics(self.query_summary, items)
+            calculate_average_ctr_per_position(items, self.position_data)
+
+    @classmethod
+    def from_pages(cls, pages):
+        summary = cls()
+        for items in pages:
+            summary.add_page(items)
+        return summary
+
+def get_search_queries_history(user_id, host_id, start_date, end_date):
+    # Подневные показы и клики по всему хосту: {индикатор: [{'date': ..., 'value': ...}]}.
+    # Нужны только режиму --history, где ответы и так хранит HistoryStore, поэтому кэш ответов не используется
+    url = SEARCH_QUERIES_HISTORY_API_URL.format(user_id=user_id, host_id=host_id)
+    params = {
+        'query_indicator': ['TOTAL_SHOWS', 'TOTAL_CLICKS'],
+        'date_from': f"{start_date}T00:00:00,000+0300",
+        'date_to': f"{end_date}T23:59:59,999+0300"
+    }
+    response = client.get(url, params=params)
+    if response.status_code != 200:
+        raise WebmasterApiError(f"Ошибка при получении истории запросов: {response.status_code} - {response.text}")
+    return response.json().get('indicators', {})
+
+
+class HistoryStore:
+    # Подневная статистика для режима --history в SQLite: по строке на URL, запрос и день,
+    # подневные итоги хостов и отметки о том, какие дни уже скачаны. Из API докачиваются
+    # только недостающие дни, а итоги за любой период собираются из базы
+    STAT_FIELDS = ('IMPRESSIONS', 'CLICKS', 'POSITION', 'CTR', 'DEMAND')
+
+    def __init__(self, path=HISTORY_DB):
+        self.path = path
+        self.conn = None
+        self.lock = threading.Lock()
+
+    def connect(self):
+        if self.conn is None:
+            self.conn = sqlite3.connect(self.path, check_same_thread=False)
+            # Столбцы статистики без типа, чтобы целые значения так и оставались целыми.
+            # item - номер повтора запроса в ответе, если API вернул его несколькими строками
+            self.conn.execute('CREATE TABLE IF NOT EXISTS query_days (url TEXT, row_url TEXT, query TEXT, item INTEGER, date TEXT, '
+                              'impressions, clicks, position, ctr, demand, PRIMARY KEY (url, row_url, query, item, date))')
+            self.conn.execute('CREATE TABLE IF NOT EXISTS host_days (host_id TEXT, date TEXT, indicator TEXT, value, '
+                              'PRIMARY KEY (host_id, date, indicator))')
+            self.conn.execute('CREATE TABLE IF NOT EXISTS fetched_days (key TEXT, date TEXT, PRIMARY KEY (key, date))')
+        return self.conn
+
+    def missing_period(self, key, start_date, end_date):
+        # Что докачать для URL или хоста: от первого недостающего дня до последнего, или None
+        with self.lock:
+            stored = {row[0] for row in self.connect().execute(
+                'SELECT date FROM fetched_days WHERE key = ? AND date BETWEEN ? AND ?', (key, start_date, end_date))}
+        missing = [day for day in iter_days(start_date, end_date) if day not in stored]
+        return (missing[0], missing[-1]) if missing else None
+
+    def mark_fetched(self, conn, key, start_date, end_date):
+        # Последние HISTORY_SETTLE_DAYS дней не отмечаем - данные за них еще могут измениться
+        settled = (datetime.now() - timedelta(days=HISTORY_SETTLE_DAYS)).strftime('%Y-%m-%d')
+        conn.executemany('INSERT OR IGNORE INTO fetched_days VALUES (?, ?)',
+                         ((key, day) for day in iter_days(start_date, end_date) if day <= settled))
+
+    def save_url_pages(self, url, start_date, end_date, pages):
+        # Раскладывает страницы аналитики по дням и заменяет ими данные URL за период
+        rows = []
+        items_seen = defaultdict(int)
+        for page in pages:
+            for item in page:
+                query_text = item.get('text_indicator', {}).get('value', 'Неизвестный запрос')
+                row_url = item.get('url', '')
+                number = items_seen[(row_url, query_text)]
+                items_seen[(row_url, query_text)] += 1
+                days = defaultdict(dict)
+                for stat in item.get('statistics', []):
+                    day = str(stat.get('date', ''))[:10]
+                    if start_date <= day <= end_date and stat.get('field') in self.STAT_FIELDS:
+                        days[day][stat['field']] = stat.get('value')
+                for day, values in days.items():
+                    rows.append((url, row_url, query_text, number, day) + tuple(values.get(field) for field in self.STAT_FIELDS))
+
+        with self.lock:
+            conn = self.connect()
+            with conn:
+                conn.execute('DELETE FROM query_days WHERE url = ? AND date BETWEEN ? AND ?', (url, start_date, end_date))
+                conn.executemany('INSERT OR REPLACE INTO query_days VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)', rows)
+                self.mark_fetched(conn, url, start_date, end_date)
+
+    def iter_url_pages(self, url, start_date, end_date, page_size=500):
+        # Строки за период в формате ответа API, чтобы их свернул QueryAnalyticsSummary
+        with self.lock:
+            rows = self.connect().execute(
+                'SELECT row_url, query, item, date, impressions, clicks, position, ctr, demand FROM query_days '
+                'WHERE url = ? AND date BETWEEN ? AND ? ORDER BY row_url, query, item, date',
+                (url, start_date, end_date)).fetchall()
+
+        items = []
+        key = None
+        for row_url, query_text, number, day, *values in rows:
+            if (row_url, query_text, number) != key:
+                key = (row_url, query_text, number)
+                items.append({'text_indicator': {'type': 'QUERY', 'value': query_text}, 'url': row_url, 'statistics': []})
+            items[-1]['statistics'].extend({'date': day, 'field': field, 'value': value}
+                                           for field, value in zip(self.STAT_FIELDS, values) if value is not None)
+        for start in range(0, len(items), page_size):
+            yield items[start:start + page_size]
+
+    def save_host_totals(self, host_id, start_date, end_date, indicators):
+        rows = [(host_id, str(point.get('date', ''))[:10], indicator, point.get('value'))
+                for indicator, points in indicators.items() for point in points]
+        with self.lock:
+            conn = self.connect()
+            with conn:
+                conn.execute('DELETE FROM host_days WHERE host_id = ? AND date BETWEEN ? AND ?', (host_id, start_date, end_date))
+                conn.executemany('INSERT OR REPLACE INTO host_days VALUES (?, ?, ?, ?)',
+                                 [row for row in rows if start_date <= row[1] <= end_date])
+                self.mark_fetched(conn, host_id, start_date, end_date)
+
+    def host_totals(self, host_id, start_date, end_date):
+        with self.lock:
+            return dict(self.connect().execute(
+                'SELECT indicator, SUM(value) FROM host_days WHERE host_id = ? AND date BETWEEN ? AND ? GROUP BY indicator',
+                (host_id, start_date, end_date)))
+
+    def close(self):
+        if self.conn is not None:
+            self.conn.close()
+            self.conn = None
+
 def read_ctr_from_csv(file_path):
     ctr_data = {}
     try:
@@ -311,91 +814,129 @@ def read_ctr_from_csv(file_path):
         print(f"Ошибка при чтении файла {file_path}: {e}")
     return ctr_data
 
-def forecast_clicks(average_position, average_ctr_per_position, total_demand, total_clicks, ctr_file):
-    # Читаем данные CTR из файла
-    ctr_data = read_ctr_from_csv(ctr_file)
-    
-    # Получаем среднее значение CTR для 1, 1-3 и 1-5 позиций
-    ctr_1_1 = [ctr_data.get(i, 0) for i in range(1, 2)]
-    ctr_1_3 = [ctr_data.get(i, 0) for i in range(1, 4)]
-    ctr_1_5 = [ctr_data.get(i, 0) for i in range(1, 6)]
-
-    ctr_1 = average_ctr_per_position.get(1, {'clicks': 0, 'impressions': 0})
-    ctr_3 = average_ctr_per_position.get(3, {'clicks': 0, 'impressions': 0})
-    ctr_5 = average_ctr_per_position.get(5, {'clicks': 0, 'impressions': 0})
-
-    # Среднее значение CTR
-    ctr_1_av = sum(ctr_1_1) / len(ctr_1_1)
-    ctr_3_av = sum(ctr_1_3) / len(ctr_1_3)
-    ctr_5_av = sum(ctr_1_5) / len(ctr_1_5)
-
-    ctr_1_value = (ctr_1['clicks'] / ctr_1['impressions']) if ctr_1['clicks'] > 0 else ctr_1_av
-    ctr_3_value = (ctr_3['clicks'] / ctr_3['impressions']) if ctr_3['clicks'] > 0 else ctr_3_av
-    ctr_5_value = (ctr_5['clicks'] / ctr_5['impressions']) if ctr_5['clicks'] > 0 else ctr_5_av
-
-    forecast_1 = 0
-    forecast_3 = 0
-    forecast_5 = 0
-    if average_position > 1:
-        forecast_1 = round(ctr_1_value * total_demand)
-    else:
-        forecast_1 = total_clicks
-    if average_position > 3:
-        forecast_3 = round(ctr_3_value * total_demand)
-    else:
-        forecast_3 = total_clicks
-    if average_position > 5:
-        forecast_5 = round(ctr_5_value * total_demand)
-    else:
-        forecast_5 = total_clicks    
-    
-    return forecast_1, forecast_3, forecast_5
+FORECAST_TOPS = (1, 3, 5)  # Позиции, на которые строится прогноз кликов
+
+def forecast_ctr(top, average_ctr_per_position, ctr_data):
+    # CTR для прогноза на позицию top: собственный CTR URL на этой позиции, если на ней были клики,
+    # иначе средний CTR позиций 1..top по кривой хоста ctr_data (из ctr_cache)
+    position = average_ctr_per_position.get(top, {'clicks': 0, 'impressions': 0})
+    if position['clicks'] > 0:
+        return position['clicks'] / position['impressions']
+    curve = [ctr_data.get(i, 0) for i in range(1, top + 1)]
+    return sum(curve) / len(curve)
+
+def forecast_clicks_batch(query_summary, average_ctr_per_position, ctr_data):
+    # Прогноз кликов на TOP-1, TOP-3 и TOP-5 сразу для всех запросов URL. Средняя позиция,
+    # спрос и клики собираются в массивы, прогноз считается векторно: CTR позиции * спрос,
+    # а если запрос уже выше этой позиции - его текущие клики. np.rint округляет
+    # к четному, как round(). Возвращает по списку на каждый TOP в порядке query_summary
+    summaries = list(query_summary.values())
+    count = np.array([summary['count'] for summary in summaries], dtype=float)
+    position_sum = np.array([summary['position_sum'] for summary in summaries], dtype=float)
+    demand = np.array([summary['total_demand'] for summary in summaries], dtype=float)
+    clicks = np.array([summary['total_clicks'] for summary in summaries])
+
+    # Средняя позиция как в format_query_analytics: округленная, 0 если позиций не было
+    average_position = np.rint(np.divide(position_sum, count, out=np.zeros_like(position_sum), where=count > 0))
+    forecasts = []
+    for top in FORECAST_TOPS:
+        forecast = np.rint(forecast_ctr(top, average_ctr_per_position, ctr_data) * demand).astype(np.int64)
+        forecasts.append(np.where(average_position > top, forecast, clicks).tolist())
+    return forecasts
 
 def read_urls_from_file(file_path):
     with open(file_path, 'r') as file:
         urls = file.readlines()
     return [url.strip() for url in urls if url.strip()]
 
-def save_results_to_csv(results, output_file, brands, stop_words):
+class KeywordMatcher:
+    # Бренды и стоп-слова один раз компилируются в две регулярки вместо перебора
+    # всех слов (и компиляции отдельного шаблона под каждое) для каждого запроса
+    def __init__(self, brands, stop_words):
+        self.brand_pattern = re.compile('|'.join(map(re.escape, brands))) if brands else None
+
+        # Стоп-слово ищется внутри просмотра вперед, поэтому находятся совпадения во всех позициях,
+        # включая перекрывающиеся. Из найденных возвращается первое по списку, как и при переборе
+        self.stop_words = stop_words
+        self.stop_word_index = {}
+        for index, stop_word in enumerate(stop_words):
+            self.stop_word_index.setdefault(stop_word, index)
+        self.stop_word_pattern = None
+        if stop_words:
+            self.stop_word_pattern = re.compile(r'(?=\b(' + '|'.join(map(re.escape, stop_words)) + r')\b)')
+
+    def is_brand(self, query_text):
+        return self.brand_pattern is not None and self.brand_pattern.search(query_text) is not None
+
+    def find_stop_word(self, query_text):
+        if self.stop_word_pattern is None:
+            return ''
+        indexes = [self.stop_word_index[match.group(1)] for match in self.stop_word_pattern.finditer(query_text)]
+        return self.stop_words[min(indexes)] if indexes else ''
+
+OUTPUT_FIELDS = ['URL', 'Запрос', 'Показы', 'Клики', 'Ср. Позиция', 'Ср. CTR', 'Спрос', '% от Спроса',
+                 'Прогноз кликов TOP-1', 'Прогноз кликов TOP-3', 'Прогноз кликов TOP-5', 'Брендовый', 'Стоп-слова', 'Новый']
+# Формат числовых столбцов в выходных таблицах; '' - число как есть
+NUMBER_FORMATS = {
+    'Показы': '',
+    'Клики': '',
+    'Ср. Позиция': '.2f',
+    'Ср. CTR': '.2f',
+    'Спрос': '',
+    '% от Спроса': '',
+    'Прогноз кликов TOP-1': '.2f',
+    'Прогноз кликов TOP-3': '.2f',
+    'Прогноз кликов TOP-5': '.2f'
+}
+COUNT_FIELDS = ('Показы', 'Клики', 'Спрос')
+
+def format_output_row(result):
+    # Единственное место, где числа превращаются в строки с десятичной запятой
+    row = dict(result)
+    for field, number_format in NUMBER_FORMATS.items():
+        if field in row:
+            value = row[field]
+            # В Parquet счетчики хранятся как float64, выводим их целыми, как при записи напрямую в CSV
+            if field in COUNT_FIELDS and isinstance(value, float) and value.is_integer():
+                value = int(value)
+            row[field] = format(value, number_format).replace('.', ',')
+    return row
+
+def tag_results(results, matcher, projects=None):
+    # Время на строку копится локально и попадает в замеры одним вызовом на URL
+    timing = stats.enabled
+    match_time = projects_time = 0.0
+    rows = 0
+    for result in results:
+        start = time.perf_counter() if timing else 0
+        query_text = result['Запрос'].lower()
+
+        # Проверка на брендовые запросы и стоп-слова
+        result['Брендовый'] = 'Да' if matcher.is_brand(query_text) else 'Нет'
+        result['Стоп-слова'] = matcher.find_stop_word(query_text)
+        if timing:
+            matched = time.perf_counter()
+            match_time += matched - start
+        result['Новый'] = projects.is_new(result['URL'], result['Запрос']) if projects else None
+        if timing:
+            projects_time += time.perf_counter() - matched
+            rows += 1
+        yield result
+    if timing:
+        stats.add_time('rows.match', match_time)
+        stats.add_time('rows.projects', projects_time)
+        stats.count('rows.written', rows)
+
+def save_results_to_csv(results, output_file, matcher, projects=None):
     with open(output_file, 'a', newline='', encoding='utf-8-sig') as csvfile:
-        fieldnames = ['URL', 'Запрос', 'Показы', 'Клики', 'Ср. Позиция', 'Ср. CTR', 'Спрос', '% от Спроса', 
-                      'Прогноз кликов TOP-1', 'Прогноз кликов TOP-3', 'Прогноз кликов TOP-5', 'Брендовый', 'Стоп-слова', 'Новый']
-        writer = csv.DictWriter(csvfile, fieldnames=fieldnames, delimiter=';')
+        writer = csv.DictWriter(csvfile, fieldnames=OUTPUT_FIELDS, delimiter=';')
         if csvfile.tell() == 0:
             writer.writeheader()
 
-        for result in results:
-            query_text = result['Запрос'].lower()
-
-            # Проверка на брендовые запросы
-            is_vital = 'Нет'
-            for brand in brands:
-                if brand in query_text:
-                    is_vital = 'Да'
-                    break
-
-            # Проверка на стоп-слова
-            stop_word_found = ''
-            for stop_word in stop_words:
-                if re.search(rf'\b{re.escape(stop_word)}\b', query_text):
-                    stop_word_found = stop_word
-                    break
-
-            result['Брендовый'] = is_vital
-            result['Стоп-слова'] = stop_word_found
-            writer.writerow(result)
+        for result in tag_results(results, matcher, projects):
+            writer.writerow(format_output_row(result))
     # print(f"Результаты сохранены в {output_file}")
 
-def save_ctr_to_csv(average_ctr_per_position, output_file):
-    with open(output_file, 'w', newline='', encoding='utf-8-sig') as csvfile:
-        fieldnames = ['Position', 'Average CTR']
-        writer = csv.DictWriter(csvfile, fieldnames=fieldnames, delimiter=';')
-        writer.writeheader()
-        for position, data in average_ctr_per_position.items():
-            average_ctr = (data['clicks'] / data['impressions'] ) if data['impressions'] > 0 else 0
-            writer.writerow({'Position': position, 'Average CTR': f"{average_ctr:.2f}".replace('.', ',')})
-    # print(f"Средний CTR для каждой позиции сохранен в {output_file}")
-
 def convert_csv_encoding(input_file, output_file, from_encoding='utf-8-sig', to_encoding='cp1251'):
     with open(input_file, 'r', encoding=from_encoding) as infile, open(output_file, 'w', encoding=to_encoding, newline='') as outfile:
         reader = csv.reader(infile, delimiter=';')
@@ -407,80 +948,411 @@ def convert_csv_encoding(input_file, output_file, from_encoding='utf-8-sig', to_
     print(f"Кодировка файла {output_file} изменена с {from_encoding} на {to_encoding}")
 
 
-def process_url(url, hosts, user_id, output_file, brands, stop_words):
-    print(f"Обрабатываем URL: {url}")
-    host_id = get_host_id_for_url(hosts, urlparse(url).netloc)
-    if not host_id:
-        print(f"Не удалось найти host_id для URL: {url}")
-        return None
+def import_pyarrow():
+    try:
+        import pyarrow
+        import pyarrow.parquet
+    except ImportError:
+        raise SystemExit("Для режима --parquet нужен пакет pyarrow: pip install pyarrow")
+    return pyarrow
 
-    query_analytics = get_query_analytics(user_id, host_id, urlparse(url).path)
-    if query_analytics is None:
-        print(f"Не удалось получить аналитику запросов для URL: {url}")
-        return host_id
-        
-    average_ctr_per_position = calculate_average_ctr_per_position(query_analytics)
-    if query_analytics:
-        formatted_data = format_query_analytics(query_analytics)
-        results = []
-        for data in formatted_data:
-            forecast_1, forecast_3, forecast_5 = forecast_clicks(data['average_position'], average_ctr_per_position, data['total_demand'],  data['total_clicks'], 'ctr.csv')
-            results.append({
-                'URL': url,
-                'Запрос': data['query'],
-                'Показы': f"{data['total_impressions']}".replace('.', ','),
-                'Клики': f"{data['total_clicks']}".replace('.', ','),
-                'Ср. Позиция': f"{data['average_position']:.2f}".replace('.', ','),
-                'Ср. CTR': f"{data['average_ctr']:.2f}".replace('.', ','),
-                'Спрос': f"{data['total_demand']}".replace('.', ','),
-                '% от Спроса': f"{data['percent_impressions_demand']}".replace('.', ','),
-                'Прогноз кликов TOP-1': f"{forecast_1:.2f}".replace('.', ','),
-                'Прогноз кликов TOP-3': f"{forecast_3:.2f}".replace('.', ','),
-                'Прогноз кликов TOP-5': f"{forecast_5:.2f}".replace('.', ',')
-            })
-        save_results_to_csv(results, output_file, brands, stop_words)
-    else:
-        print(f"Не удалось получить аналитику запросов для URL: {url}")
 
-    return host_id
+class CsvOutput:
+    # Результаты сразу пишутся в итоговый CSV. Позиция для журнала - размер файла в байтах
+    def __init__(self, path=OUTPUT_CSV):
+        self.path = path
 
-def get_project_csv_path(urls_file, projects_folder):
-    with open(urls_file, 'r') as f:
-        first_url = f.readline().strip()
-    domain = urlparse(first_url).netloc
-    project_csv = os.path.join(projects_folder, f"{domain}.csv")
-    print(f"Домен: {domain}")
-    return project_csv
+    def exists(self):
+        return os.path.exists(self.path)
 
-def mark_new_queries(query_analytics_csv, project_csv):
-    try:
-        # Чтение столбца "Запрос" из файла query_analytics.csv
-        query_df = pd.read_csv(query_analytics_csv, encoding='utf-8-sig', delimiter=';', on_bad_lines='skip')
-        
-        if 'Запрос' not in query_df.columns:
-            print(f"В файле {query_analytics_csv} не найден столбец 'Запрос'. Найдены столбцы: {query_df.columns}")
+    def size(self):
+        return os.path.getsize(self.path) if self.exists() else 0
+
+    def truncate(self, size):
+        with open(self.path, 'r+b') as file:
+            file.truncate(size)
+
+    def reset(self):
+        open(self.path, 'w').close()
+
+    def close(self):
+        pass
+
+    def write(self, results, matcher, projects=None):
+        save_results_to_csv(results, self.path, matcher, projects)
+
+
+class ParquetOutput:
+    # Результаты всех URL - один файл Parquet с типизированными столбцами, который пишет
+    # один ParquetWriter. Строки копятся до PARQUET_ROW_GROUP и уходят в файл группой строк.
+    # Позиция для журнала - число записанных строк. Футер с описанием групп пишет только close(),
+    # поэтому продолжить после аварийного завершения без close() нельзя - сбор начнется заново
+    def __init__(self, path=OUTPUT_PARQUET):
+        self.path = path
+        self.previous = path + '.previous'  # Прежний файл, пока его начало переписывается в новый
+        pa = import_pyarrow()
+        self.schema = pa.schema([(field, pa.float64() if field in NUMBER_FORMATS else pa.int64() if field == 'Новый' else pa.string())
+                                 for field in OUTPUT_FIELDS])
+        self.writer = None
+        self.buffer = []
+        self.buffered = 0
+        self.rows = 0
+
+    def source(self):
+        # Прерванный truncate() оставляет прежний файл в .previous - он и есть актуальные данные
+        return self.previous if os.path.exists(self.previous) else self.path
+
+    def exists(self):
+        return self.writer is not None or os.path.exists(self.source())
+
+    def size(self):
+        if self.writer is not None:
+            return self.rows
+        pa = import_pyarrow()
+        try:
+            return pa.parquet.ParquetFile(self.source()).metadata.num_rows
+        except (OSError, pa.ArrowInvalid):
+            return 0  # Файл без футера (запуск оборвался без close()) прочитать нельзя
+
+    def open(self):
+        pa = import_pyarrow()
+        self.writer = pa.parquet.ParquetWriter(self.path, self.schema)
+        self.buffer = []
+        self.buffered = 0
+        self.rows = 0
+
+    def truncate(self, size):
+        # Дописывать в закрытый Parquet нельзя: первые size строк переписываются в новый файл,
+        # в который дальше пишет этот же writer
+        if size == 0:
+            self.reset()
             return
+        pa = import_pyarrow()
+        if not os.path.exists(self.previous):
+            os.replace(self.path, self.previous)
+        self.open()
+        source = pa.parquet.ParquetFile(self.previous)
+        for index in range(source.num_row_groups):
+            if self.rows >= size:
+                break
+            self.append(source.read_row_group(index).slice(0, size - self.rows))
+        self.flush()
+        source.close()
+        os.remove(self.previous)
+
+    def reset(self):
+        self.close()
+        if os.path.exists(self.previous):
+            os.remove(self.previous)
+        self.open()
+
+    def append(self, table):
+        self.buffer.append(table)
+        self.buffered += table.num_rows
+        self.rows += table.num_rows
+        if self.buffered >= PARQUET_ROW_GROUP:
+            self.flush()
+
+    def flush(self):
+        if self.buffer:
+            pa = import_pyarrow()
+            self.writer.write_table(pa.concat_tables(self.buffer), row_group_size=max(self.buffered, 1))
+            self.buffer = []
+            self.buffered = 0
+
+    def close(self):
+        if self.writer is not None:
+            self.flush()
+            self.writer.close()
+            self.writer = None
+
+    def write(self, results, matcher, projects=None):
+        pa = import_pyarrow()
+        rows = [{field: result[field] for field in self.schema.names} for result in tag_results(results, matcher, projects)]
+        if rows:
+            self.append(pa.Table.from_pylist(rows, schema=self.schema))
+
+    def iter_records(self):
+        pa = import_pyarrow()
+        self.close()
+        for batch in pa.parquet.ParquetFile(self.path).iter_batches():
+            yield from batch.to_pylist()
 
-        # Чтение столбца "Запрос" из файла project_csv
-        project_df = pd.read_csv(project_csv, encoding='utf-8-sig', delimiter=';', on_bad_lines='skip')
-        
-        if 'Запрос' not in project_df.columns:
-            print(f"В файле {project_csv} не найден столбец 'Запрос'. Найдены столбцы: {project_df.columns}")
+    def render(self, csv_file, cp1251_file):
+        # Итоговые таблицы собираются за один проход по файлу
+        with open(csv_file, 'w', newline='', encoding='utf-8-sig') as csvfile, \
+                open(cp1251_file, 'w', newline='', encoding='cp1251') as cp1251file:
+            writer = csv.DictWriter(csvfile, fieldnames=OUTPUT_FIELDS, delimiter=';')
+            cp1251_writer = csv.writer(cp1251file, delimiter=';')
+            writer.writeheader()
+            cp1251_writer.writerow(OUTPUT_FIELDS)
+            for record in self.iter_records():
+                row = format_output_row(record)
+                writer.writerow(row)
+                # Заменяем неподдерживаемые символы
+                cells = ['' if row.get(field) is None else str(row[field]) for field in OUTPUT_FIELDS]
+                cp1251_writer.writerow([cell.encode('cp1251', errors='replace').decode('cp1251') for cell in cells])
+        print(f"Результаты из {self.path} сохранены в {csv_file} и {cp1251_file}")
+
+
+class CheckpointJournal:
+    # Журнал прогресса рядом с результатами: после записи строк каждого URL в него
+    # добавляется строка "<позиция>\t<URL>", где позиция - размер CSV или число строк Parquet.
+    # При перезапуске собранные URL пропускаются, а недописанный хвост результатов отбрасывается
+    def __init__(self, output):
+        self.output = output
+        self.path = output.path + '.journal'
+        self.completed = set()
+
+    def start(self):
+        offset = None
+        if os.path.exists(self.path):
+            with open(self.path, 'r', encoding='utf-8') as file:
+                for line in file:
+                    line_offset, _, url = line.rstrip('\n').partition('\t')
+                    offset = int(line_offset)
+                    if url:
+                        self.completed.add(url)
+
+        if offset is not None and self.output.exists() and self.output.size() >= offset:
+            self.output.truncate(offset)
+            print(f"Продолжаем прерванный запуск, уже собрано URL: {len(self.completed)}")
             return
-        
-        # Создание множества запросов из файла проекта
-        project_queries = set(project_df['Запрос'].astype(str))
 
-        # Добавляем столбец "Новый" в query_df
-        query_df['Новый'] = query_df['Запрос'].apply(lambda x: 1 if x not in project_queries else 0)
+        if offset is not None:
+            print(f"Журнал {self.path} не совпадает с {self.output.path}, начинаем сбор заново")
+        self.completed = set()
+        self.output.reset()
+        open(self.path, 'w').close()
+
+    def record(self, url=''):
+        # Пустой URL - просто фиксируем новую позицию (например, после перезаписи файла)
+        offset = self.output.size()
+        with open(self.path, 'a', encoding='utf-8') as file:
+            file.write(f"{offset}\t{url}\n")
+            file.flush()
+            os.fsync(file.fileno())
+        if url:
+            self.completed.add(url)
 
-        # Сохранение результата обратно в query_analytics.csv
-        query_df.to_csv(query_analytics_csv, index=False, encoding='utf-8-sig', sep=';')
+    def finish(self):
+        if os.path.exists(self.path):
+            os.remove(self.path)
 
-    except Exception as e:
-        print(f"Произошла ошибка: {e}")
 
-def main():
+def process_url(url, host_id, user_id, summary=None):
+    # Выполняется в пуле потоков: только собирает данные, в файлы не пишет.
+    # host_id уже найден в main() по HostIndex.
+    # summary передается, если данные уже собраны из HistoryStore.
+    # Возвращает генератор строк результата или None, если аналитику получить не удалось
+    print(f"Обрабатываем URL: {url}")
+    if summary is None:
+        start = time.perf_counter()
+        try:
+            summary = QueryAnalyticsSummary.from_pages(get_query_analytics(user_id, host_id, urlparse(url).path))
+            stats.observe('url.fetch', time.perf_counter() - start)
+        except WebmasterApiError as e:
+            print(e)
+            print(f"Не удалось получить аналитику запросов для URL: {url}")
+            return None
+
+    ctr_data = ctr_cache.get(user_id, host_id)
+    # Строки результата отдаются генератором и пишутся в файл по мере формирования
+    return iter_url_results(url, summary.query_summary, summary.position_data, ctr_data)
+
+def iter_url_results(url, query_summary, average_ctr_per_position, ctr_data):
+    # rows.build - format_query_analytics вместе с прогнозом, rows.forecast - только прогноз
+    timing = stats.enabled
+    start = time.perf_counter() if timing else 0
+    with stats.stage('rows.forecast'):
+        forecasts = zip(*forecast_clicks_batch(query_summary, average_ctr_per_position, ctr_data))
+    build_time = 0.0
+    for data, (forecast_1, forecast_3, forecast_5) in zip(format_query_analytics(query_summary), forecasts):
+        if timing:
+            build_time += time.perf_counter() - start
+        # Числа остаются числами, в строки с запятой их превращает только format_output_row при записи
+        yield {
+            'URL': url,
+            'Запрос': data['query'],
+            'Показы': data['total_impressions'],
+            'Клики': data['total_clicks'],
+            'Ср. Позиция': data['average_position'],
+            'Ср. CTR': data['average_ctr'],
+            'Спрос': data['total_demand'],
+            '% от Спроса': data['percent_impressions_demand'],
+            'Прогноз кликов TOP-1': forecast_1,
+            'Прогноз кликов TOP-3': forecast_3,
+            'Прогноз кликов TOP-5': forecast_5
+        }
+        if timing:
+            start = time.perf_counter()
+    if timing:
+        build_time += time.perf_counter() - start
+        stats.add_time('rows.build', build_time)
+
+def process_url_history(url, host_id, user_id, store, start_date, end_date):
+    # Режим --history: недостающие дни докачиваются в store, итоги за период собираются из него
+    period = store.missing_period(url, start_date, end_date)
+    if period:
+        try:
+            # Скачанные дни хранит store, поэтому кэш ответов не нужен: в нем была бы вторая копия страниц,
+            # а за еще не устоявшиеся дни - и устаревшие данные
+            pages = get_query_analytics(user_id, host_id, urlparse(url).path, *period, cached=False)
+            store.save_url_pages(url, *period, pages)
+        except WebmasterApiError as e:
+            print(e)
+            print(f"Не удалось получить аналитику запросов для URL: {url}")
+            return None
+    summary = QueryAnalyticsSummary.from_pages(store.iter_url_pages(url, start_date, end_date))
+    return process_url(url, host_id, user_id, summary)
+
+def process_host_history(host_id, user_id, store, start_date, end_date):
+    # Подневные показы и клики хоста за период: докачиваются только недостающие дни
+    period = store.missing_period(host_id, start_date, end_date)
+    if period:
+        try:
+            store.save_host_totals(host_id, *period, get_search_queries_history(user_id, host_id, *period))
+        except WebmasterApiError as e:
+            print(e)
+    totals = store.host_totals(host_id, start_date, end_date)
+    print(f"Хост {host_id} с {start_date} по {end_date}: показов {totals.get('TOTAL_SHOWS', 0)}, кликов {totals.get('TOTAL_CLICKS', 0)}")
+
+class ProjectIndex:
+    # Запросы проектов для столбца "Новый": Projects/<домен>.sqlite с индексом по запросу,
+    # отдельный для каждого домена из списка URL. Projects/<домен>.csv импортируется в него
+    # при первом запуске и заново - только если файл изменился, поэтому большой архив
+    # не читается целиком при каждом запуске. Работает только из основного потока
+    def __init__(self, folder=PROJECTS_FOLDER, update=False):
+        self.folder = folder
+        self.update = update  # Запоминать новые запросы, чтобы save() добавил их в индексы
+        self.connections = {}
+        self.seen = defaultdict(set)
+
+    def connect(self, domain):
+        if domain in self.connections:
+            return self.connections[domain]
+
+        db_path = os.path.join(self.folder, f"{domain}.sqlite")
+        csv_path = os.path.join(self.folder, f"{domain}.csv")
+        conn = None
+        if os.path.exists(csv_path) and 'Запрос' not in self.read_header(csv_path):
+            # Без столбца запросов проекта нет: иначе все запросы были бы отмечены как новые
+            print(f"Домен: {domain}, столбец \"Новый\" останется пустым")
+        elif self.update or os.path.exists(db_path) or os.path.exists(csv_path):
+            os.makedirs(self.folder, exist_ok=True)
+            conn = sqlite3.connect(db_path)
+            conn.execute('CREATE TABLE IF NOT EXISTS queries (query TEXT PRIMARY KEY, source TEXT)')
+            conn.execute('CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value TEXT)')
+            self.import_csv(conn, csv_path)
+            count = conn.execute('SELECT COUNT(*) FROM queries').fetchone()[0]
+            print(f"Домен: {domain}, запросов в проекте: {count}")
+        else:
+            print(f"Домен: {domain}, проекта в папке {self.folder} нет, столбец \"Новый\" останется пустым")
+        self.connections[domain] = conn
+        return conn
+
+    def read_header(self, csv_path):
+        with open(csv_path, 'r', encoding='utf-8-sig', newline='') as file:
+            header = next(csv.reader(file, delimiter=';'), [])
+        if 'Запрос' not in header:
+            print(f"В файле {csv_path} не найден столбец 'Запрос'. Найдены столбцы: {header}")
+        return header
+
+    def import_csv(self, conn, csv_path):
+        if not os.path.exists(csv_path):
+            return
+        source = os.stat(csv_path)
+        stamp = f"{source.st_size}:{source.st_mtime_ns}"
+        row = conn.execute("SELECT value FROM meta WHERE key = 'csv'").fetchone()
+        if row and row[0] == stamp:
+            return
+
+        with open(csv_path, 'r', encoding='utf-8-sig', newline='') as file, stats.stage('projects.import'):
+            reader = csv.reader(file, delimiter=';')
+            column = next(reader).index('Запрос')
+            # Запросы, добавленные из прошлых запусков (source = 'run'), сохраняются
+            conn.execute("DELETE FROM queries WHERE source = 'csv'")
+            conn.executemany("INSERT OR IGNORE INTO queries VALUES (?, 'csv')",
+                             ((row[column],) for row in reader if len(row) > column))
+        conn.execute("INSERT OR REPLACE INTO meta VALUES ('csv', ?)", (stamp,))
+        conn.commit()
+        print(f"Файл {csv_path} загружен в индекс проекта")
+
+    def is_new(self, url, query):
+        # 1 - запроса нет в проекте домена, 0 - есть, None - проекта нет
+        domain = urlparse(url).netloc
+        conn = self.connect(domain)
+        if conn is None:
+            return None
+        # Запросы, найденные в этом или прерванном запуске (source = 'pending'), еще новые
+        if conn.execute("SELECT 1 FROM queries WHERE query = ? AND source != 'pending'", (query,)).fetchone():
+            return 0
+        if self.update:
+            self.seen[domain].add(query)
+        return 1
+
+    def flush(self):
+        # Сохраняет запросы, встреченные с прошлого вызова, как 'pending'. Вызывается перед записью
+        # URL в журнал: если запуск прервется, при продолжении эти URL будут пропущены,
+        # а их новые запросы уже лежат в индексе и попадут в проект в конце
+        for domain, queries in self.seen.items():
+            conn = self.connections[domain]
+            conn.executemany("INSERT OR IGNORE INTO queries VALUES (?, 'pending')", ((query,) for query in queries))
+            conn.commit()
+        self.seen.clear()
+
+    def save(self):
+        # Добавляет в индексы запросы, впервые встреченные в этом запуске и в прерванном, который он
+        # продолжил. Вызывается после сбора, чтобы запрос, найденный на нескольких URL, везде был отмечен как новый
+        self.flush()
+        for domain, conn in self.connections.items():
+            if conn is None:
+                continue
+            count = conn.execute("UPDATE queries SET source = 'run' WHERE source = 'pending'").rowcount
+            conn.commit()
+            if count:
+                print(f"В проект {domain} добавлено новых запросов: {count}")
+
+    def close(self):
+        for conn in self.connections.values():
+            if conn is not None:
+                conn.close()
+        self.connections = {}
+
+class BatchProject:
+    # Папка проекта: свои urls.txt, brand.txt и stopwords.txt (если их нет - берутся общие
+    # из папки скрипта) и свои файлы результатов. Обычный запуск - один проект в папке скрипта
+    def __init__(self, folder, parquet=False):
+        self.folder = folder
+        self.name = os.path.basename(os.path.abspath(folder))
+        self.urls = read_urls_from_file(self.path(URLS_FILE)) if os.path.exists(self.path(URLS_FILE)) else []
+        brands = load_brand_names(self.path('brand.txt') if os.path.exists(self.path('brand.txt')) else 'brand.txt')
+        stop_words = load_stop_words(self.path('stopwords.txt') if os.path.exists(self.path('stopwords.txt')) else 'stopwords.txt')
+        self.matcher = KeywordMatcher(brands, stop_words)
+        self.output = ParquetOutput(self.path(OUTPUT_PARQUET)) if parquet else CsvOutput(self.path(OUTPUT_CSV))
+        self.journal = CheckpointJournal(self.output)
+        self.failed_urls = 0
+
+    def path(self, name):
+        return os.path.normpath(os.path.join(self.folder, name))
+
+def find_batch_projects(batch_folder, parquet=False):
+    # Проекты пакетного запуска - подпапки batch_folder, в которых есть urls.txt
+    batch_projects = []
+    for name in sorted(os.listdir(batch_folder)):
+        folder = os.path.join(batch_folder, name)
+        if os.path.isfile(os.path.join(folder, URLS_FILE)):
+            batch_projects.append(BatchProject(folder, parquet))
+    return batch_projects
+
+def interleave(task_lists):
+    # Задачи разных проектов чередуются, чтобы большой проект не занимал пул целиком
+    for tasks in zip_longest(*task_lists):
+        yield from (task for task in tasks if task is not None)
+
+def main(parquet=False, update_projects=False, history=None, batch=None):
+    # history - (начало, конец) периода для режима --history или None,
+    # batch - папка с проектами для пакетного запуска или None
     user_id = get_user_id()
     if not user_id:
         print("Не удалось получить user_id")
@@ -491,39 +1363,175 @@ def main():
         print("Не удалось получить список хостов")
         return
 
-    urls = read_urls_from_file(URLS_FILE)
-    if not urls:
+    batch_projects = find_batch_projects(batch, parquet) if batch else [BatchProject('.', parquet)]
+    batch_projects = [batch_project for batch_project in batch_projects if batch_project.urls]
+    if not batch_projects:
         print(f"Файл {URLS_FILE} пуст или не найден")
         return
-    
-    # Загрузка брендовых названий и стоп-слов
-    brands = load_brand_names('brand.txt')
-    stop_words = load_stop_words('stopwords.txt')
 
     #  update_urls_from_yandex_api(ACCESS_TOKEN, "")    
 
-    # Список для хранения всех данных CTR
-    all_ctr_data = defaultdict(lambda: {'clicks': 0, 'impressions': 0})
+    project_index = ProjectIndex(update=update_projects)
+    host_index = HostIndex(hosts)
+    store = HistoryStore() if history else None
 
-    # Process each URL
-    for url in urls:
-        url = url.strip()
-        if url:
-            # Получение и сохранение среднего CTR по популярным запросам
-            process_site_ctr(url, hosts, user_id, 'ctr.csv')
-            host_id = process_url(url, hosts, user_id, OUTPUT_CSV, brands, stop_words)
+    # Для каждого проекта: продолжаем прерванный запуск или начинаем новый файл результатов,
+    # а оставшиеся URL один раз группируем по хостам
+    task_lists = []
+    for batch_project in batch_projects:
+        if batch:
+            print(f"Проект: {batch_project.name}, URL: {len(batch_project.urls)}")
+        batch_project.journal.start()
+        urls_by_host = defaultdict(list)
+        for url in batch_project.urls:
+            if url in batch_project.journal.completed:
+                if update_projects:
+                    # Новые запросы URL, собранных до перерыва, лежат в индексе домена и попадут в проект в save()
+                    project_index.connect(urlparse(url).netloc)
+                continue
+            host_id = host_index.find(url)
             if host_id:
-                query_analytics = get_query_analytics(user_id, host_id, urlparse(url).path)
-                if query_analytics:  # Проверка на None
-                    average_ctr_per_position = calculate_average_ctr_per_position(query_analytics)
-                    for position, data in average_ctr_per_position.items():
-                        all_ctr_data[position]['clicks'] += data['clicks']
-                        all_ctr_data[position]['impressions'] += data['impressions']
+                urls_by_host[host_id].append(url)
+            else:
+                print(f"Не удалось найти host_id для URL: {url}")
+                batch_project.journal.record(url)
+
+        # Получение и сохранение среднего CTR по популярным запросам - один раз на хост.
+        # Делаем это до параллельного сбора, чтобы потоки не перезаписывали ctr.csv одновременно
+        for host_id in urls_by_host:
+            with stats.stage('ctr'):
+                process_site_ctr(host_id, user_id, batch_project.path('ctr.csv'))
+            if history:
+                with stats.stage('history.host'):
+                    process_host_history(host_id, user_id, store, *history)
+
+        task_lists.append([(batch_project, host_id, url) for host_id, host_urls in urls_by_host.items() for url in host_urls])
+
+    # Запросы к API всех проектов выполняются в общем пуле и с общим ограничителем скорости,
+    # а запись в файлы - только из основного потока, чтобы строки разных URL не перемешивались
+    try:
+        with ThreadPoolExecutor(max_workers=MAX_WORKERS) as executor:
+            def submit(batch_project, host_id, url):
+                if history:
+                    future = executor.submit(process_url_history, url, host_id, user_id, store, *history)
+                else:
+                    future = executor.submit(process_url, url, host_id, user_id)
+                futures[future] = (batch_project, url)
+
+            try:
+                # В пуле не больше SUBMIT_WINDOW задач: на место записанной ставится следующая,
+                # а записанная убирается из futures вместе со строками URL
+                tasks = interleave(task_lists)
+                futures = {}
+                for task in islice(tasks, SUBMIT_WINDOW):
+                    submit(*task)
+                while futures:
+                    done, _ = wait(futures, return_when=FIRST_COMPLETED)
+                    for future in done:
+                        batch_project, url = futures.pop(future)
+                        results = future.result()
+                        # URL, по которому API вернул ошибку, в журнал не пишем - он будет докачан при перезапуске
+                        if results is None:
+                            batch_project.failed_urls += 1
+                            stats.count('urls.failed')
+                        else:
+                            with stats.stage('write'):
+                                batch_project.output.write(results, batch_project.matcher, project_index)
+                            if update_projects:
+                                project_index.flush()
+                            batch_project.journal.record(url)
+                            stats.count('urls.done')
+                        for task in islice(tasks, 1):
+                            submit(*task)
+            except BaseException:
+                # При ошибке или Ctrl+C снимаем задачи, которые потоки еще не взяли, иначе выход
+                # из with дождался бы их все; ждем только URL, которые уже скачиваются
+                executor.shutdown(wait=False, cancel_futures=True)
+                raise
+    finally:
+        # Закрытый файл Parquet можно продолжить при следующем запуске, в том числе после Ctrl+C
+        for batch_project in batch_projects:
+            batch_project.output.close()
+
+    if store:
+        store.close()
+    if update_projects:
+        project_index.save()
+    project_index.close()
+
+    for batch_project in batch_projects:
+        with stats.stage('render'):
+            if parquet:
+                batch_project.output.render(batch_project.path(OUTPUT_CSV), batch_project.path('query_analytics_cp1251.csv'))
+            else:
+                convert_csv_encoding(batch_project.path(OUTPUT_CSV), batch_project.path('query_analytics_cp1251.csv'),
+                                     from_encoding='utf-8-sig', to_encoding='cp1251')
+
+    limiter = client.limiter
+    stats.set_info('limiter', {'requests': limiter.requests, 'retries': limiter.retries, 'throttled': limiter.throttled,
+                               'throttled_time': round(limiter.throttled_time, 2),
+                               'pacing_time': round(limiter.pacing_time, 2), 'backoff_time': round(limiter.backoff_time, 2),
+                               'rate': round(limiter.rate, 2)})
+    print(client.limiter.report())
+    for batch_project in batch_projects:
+        if not batch_project.failed_urls:
+            batch_project.journal.finish()
+        elif batch:
+            print(f"Проект {batch_project.name}: не удалось собрать URL: {batch_project.failed_urls}")
+        else:
+            print(f"Не удалось собрать URL: {batch_project.failed_urls}. Запустите скрипт еще раз, чтобы докачать только их")
+    if batch and any(batch_project.failed_urls for batch_project in batch_projects):
+        print("Запустите скрипт еще раз, чтобы докачать только их")
+
+def parse_date(value):
+    try:
+        return datetime.strptime(value, '%Y-%m-%d').strftime('%Y-%m-%d')
+    except ValueError:
+        raise argparse.ArgumentTypeError(f"дата должна быть в формате YYYY-MM-DD: {value}")
 
-    # Обновляем столбец с новыми запросами
-    project_csv = get_project_csv_path(URLS_FILE, "Projects")
-    mark_new_queries("query_analytics.csv", project_csv)
+def parse_args():
+    parser = argparse.ArgumentParser(description='Сбор запросов по списку URL из API Яндекс Вебмастера')
+    parser.add_argument('--refresh', action='store_true',
+                        help='не брать ответы API из кэша, а скачать их заново')
+    parser.add_argument('--cache-ttl', type=float, default=CACHE_TTL / 3600,
+                        help='сколько часов ответ API в кэше считается актуальным (по умолчанию %(default)s)')
+    parser.add_argument('--memory', '--tracemalloc', action='store_true',
+                        help='отслеживать пиковое потребление памяти и вывести его в конце (замедляет работу)')
+    parser.add_argument('--stats', metavar='FILE',
+                        help='замерить время, счетчики и задержки по стадиям и сохранить итог в FILE (JSON)')
+    parser.add_argument('--cprofile', metavar='FILE',
+                        help='снять профиль cProfile основного потока и сохранить его в FILE')
+    parser.add_argument('--parquet', action='store_true',
+                        help=f'собирать результаты в {OUTPUT_PARQUET} (нужен pyarrow), CSV строится из него в конце')
+    parser.add_argument('--update-projects', action='store_true',
+                        help=f'добавить новые запросы в индексы проектов {PROJECTS_FOLDER}/<домен>.sqlite (создаются при необходимости)')
+    parser.add_argument('--history', action='store_true',
+                        help=f'хранить подневную статистику в {HISTORY_DB} и докачивать из API только недостающие дни')
+    parser.add_argument('--date-from', type=parse_date,
+                        help=f'начало периода для --history, YYYY-MM-DD (по умолчанию {ANALYTICS_DAYS} дней назад)')
+    parser.add_argument('--date-to', type=parse_date,
+                        help='конец периода для --history, YYYY-MM-DD (по умолчанию сегодня)')
+    parser.add_argument('--batch', metavar='DIR',
+                        help='пакетный запуск: каждая подпапка DIR с urls.txt - отдельный проект со своими '
+                             'brand.txt, stopwords.txt и файлами результатов (путь - от папки скрипта)')
+    args = parser.parse_args()
+    if (args.date_from or args.date_to) and not args.history:
+        parser.error('--date-from и --date-to работают только вместе с --history')
+    if args.batch and not os.path.isdir(args.batch):
+        parser.error(f'папка для --batch не найдена: {os.path.abspath(args.batch)}')
+    return args
 
 if __name__ == "__main__":
-    main()
-    convert_csv_encoding('query_analytics.csv', 'query_analytics_cp1251.csv', from_encoding='utf-8-sig', to_encoding='cp1251')
+    args = parse_args()
+    client.cache.refresh = args.refresh
+    ctr_cache.refresh = args.refresh
+    client.cache.ttl = args.cache_ttl * 3600
+    history = None
+    if args.history:
+        start_date, end_date = default_period()
+        history = (args.date_from or start_date, args.date_to or end_date)
+    with profiled(args.stats, args.cprofile, args.memory):
+        stats.set_info('options', {'parquet': args.parquet, 'history': history, 'batch': args.batch,
+                                   'workers': MAX_WORKERS})
+        with stats.stage('main'):
+            main(parquet=args.parquet, update_projects=args.update_projects, history=history, batch=args.batch)